@@ -0,0 +1,290 @@
+"""
+Benchmarks for acouachecksum/main.py.
+
+Generates synthetic datasets in a temporary folder, then measures the
+throughput (MB/s, files/s) and peak memory of:
+  - md5Checksum2, on many small files and on a few huge files
+  - handleArchive, for every archive format (zip, stored zip, tar, tar.gz,
+    7z, and rar when the rar executable is available)
+  - the listing phase (list_dataset), on a deep tree and on archives
+
+Each benchmark runs in a fresh process, so that its peak RSS is its own.
+Results are saved as JSON, to compare versions with --compare.
+
+Run with:
+    python benchmark.py [--scale 1.0] [--output bench_results.json]
+                        [--only NAME ...] [--compare previous.json]
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+import py7zr
+
+sys.path.insert(0, str(Path(__file__).parent))
+import main  # noqa: E402
+
+# ---------------------------------------------------------------------------
+# Synthetic datasets
+# ---------------------------------------------------------------------------
+
+def payload(rng: random.Random, size: int) -> bytes:
+    """Half random, half repetitive data: compressible like real datasets."""
+    half = size // 2
+    filler = b"ACOUA" * ((size - half) // 5 + 1)
+    return rng.randbytes(half) + filler[: size - half]
+
+
+def make_dataset(root: Path, scale: float) -> dict:
+    """Create the benchmark datasets under root and describe them."""
+    rng = random.Random(42)
+    n_small = max(10, int(2000 * scale))
+    n_members = max(10, int(2000 * scale))
+    huge_size = max(2**20, int(256 * 2**20 * scale))
+    member_size = 16 * 2**10
+
+    small = root / "small"
+    small.mkdir()
+    for n in range(n_small):
+        (small / f"file{n:06}.dat").write_bytes(payload(rng, 4096))
+
+    huge = root / "huge"
+    huge.mkdir()
+    for n in range(2):
+        with (huge / f"huge{n}.bin").open("wb") as fh:
+            written = 0
+            while written < huge_size:
+                block = payload(rng, min(2**22, huge_size - written))
+                fh.write(block)
+                written += len(block)
+
+    # deep and wide: 30 levels, a few files per level
+    deep = root / "deep"
+    level = deep
+    for depth in range(30):
+        level = level / f"level{depth:02}"
+        level.mkdir(parents=True)
+        for n in range(max(1, int(20 * scale))):
+            (level / f"f{n}.txt").write_bytes(b"x" * 64)
+        for n in range(max(1, int(5 * scale))):
+            (deep / f"side{depth:02}_{n}").mkdir(parents=True, exist_ok=True)
+
+    members = {
+        f"dir{n % 10}/member{n:06}.dat": payload(rng, member_size)
+        for n in range(n_members)
+    }
+    archives = root / "archives"
+    archives.mkdir()
+    with zipfile.ZipFile(archives / "deflated.zip", "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    with zipfile.ZipFile(archives / "stored.zip", "w", zipfile.ZIP_STORED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    for mode, filename in (("w", "plain.tar"), ("w:gz", "compressed.tar.gz")):
+        with tarfile.open(archives / filename, mode) as tf:
+            for name, data in members.items():
+                info = tarfile.TarInfo(name=name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+    with py7zr.SevenZipFile(archives / "solid.7z", "w") as sz:
+        for name, data in members.items():
+            sz.writestr(data, name)
+    rar_available = shutil.which("rar") is not None
+    if rar_available:
+        src = root / "rar_source"
+        src.mkdir()
+        for name, data in members.items():
+            (src / name).parent.mkdir(parents=True, exist_ok=True)
+            (src / name).write_bytes(data)
+        subprocess.run(
+            ["rar", "a", "-r", "-idq", str(archives / "archive.rar"), "."],
+            cwd=src,
+            check=True,
+        )
+        shutil.rmtree(src)
+
+    return {
+        "root": str(root),
+        "n_small": n_small,
+        "n_members": n_members,
+        "huge_size": huge_size,
+        "member_size": member_size,
+        "rar_available": rar_available,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks: each returns (bytes processed, files processed)
+# ---------------------------------------------------------------------------
+
+def folder_files(folder: Path) -> list:
+    return sorted(p for p in folder.rglob("*") if p.is_file())
+
+
+def bench_md5_small_files(dataset):
+    files = folder_files(Path(dataset["root"]) / "small")
+    for path in files:
+        main.md5_file(str(path))
+    return (sum(p.stat().st_size for p in files), len(files))
+
+
+def bench_md5_huge_files(dataset):
+    files = folder_files(Path(dataset["root"]) / "huge")
+    for path in files:
+        main.md5_file(str(path))
+    return (sum(p.stat().st_size for p in files), len(files))
+
+
+def archive_bench(filename, extension):
+    def bench(dataset):
+        path = os.path.join(dataset["root"], "archives", filename)
+        sink = main.NullProgress()
+        with main.ArchiveSession(path, extension) as session:
+            md5list, _ = main.handleArchive(
+                session.members, session.open(), len(session.members), 0, 1, sink, sink
+            )
+        return (dataset["member_size"] * len(md5list), len(md5list))
+
+    return bench
+
+
+def listing_bench(folder, archiver_list):
+    def bench(dataset):
+        root = os.path.join(dataset["root"], folder)
+        sink = main.NullProgress()
+        reporter = main.ProgressReporter(sink, sink)
+        choosedir = main.start_run(root)
+        try:
+            files, _, archive_content, total_files = main.list_dataset(
+                choosedir, archiver_list, [main.error_file], 0, reporter
+            )
+            for sessions in archive_content.values():
+                for session in sessions:
+                    session.close()
+        finally:
+            main.stop_error_log()
+            os.remove(main.error_file)
+        return (0, total_files)
+
+    return bench
+
+
+BENCHMARKS = {
+    "md5_small_files": bench_md5_small_files,
+    "md5_huge_files": bench_md5_huge_files,
+    "archive_zip_deflated": archive_bench("deflated.zip", ".zip"),
+    "archive_zip_stored": archive_bench("stored.zip", ".zip"),
+    "archive_tar": archive_bench("plain.tar", ".tar"),
+    "archive_tar_gz": archive_bench("compressed.tar.gz", ".tar.gz"),
+    "archive_7z": archive_bench("solid.7z", ".7z"),
+    "archive_rar": archive_bench("archive.rar", ".rar"),
+    "listing_deep_tree": listing_bench("deep", []),
+    "listing_archives": listing_bench("archives", [".zip", ".tar", ".tar.gz", ".7z"]),
+}
+
+
+# ---------------------------------------------------------------------------
+# Runner
+# ---------------------------------------------------------------------------
+
+def run_one(name, dataset, queue):
+    """Child process: run one benchmark and report its measurements."""
+    start = time.perf_counter()
+    n_bytes, n_files = BENCHMARKS[name](dataset)
+    seconds = time.perf_counter() - start
+    queue.put(
+        {
+            "name": name,
+            "seconds": round(seconds, 4),
+            "bytes": n_bytes,
+            "files": n_files,
+            "mb_per_s": round(n_bytes / 2**20 / seconds, 2) if n_bytes else None,
+            "files_per_s": round(n_files / seconds, 1),
+            "peak_rss_kib": main.peak_rss_kib(),
+        }
+    )
+
+
+def run_benchmarks(names, dataset):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name in names:
+        if name == "archive_rar" and not dataset["rar_available"]:
+            results.append({"name": name, "skipped": "rar executable not found"})
+            continue
+        queue = context.Queue()
+        process = context.Process(target=run_one, args=(name, dataset, queue))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            results.append({"name": name, "failed": f"exit code {process.exitcode}"})
+        else:
+            results.append(queue.get())
+        print(json.dumps(results[-1]), file=sys.stderr)
+    return results
+
+
+def compare(results, previous_path):
+    """Print the throughput ratio of each benchmark against a previous run."""
+    with open(previous_path) as fh:
+        previous = {r["name"]: r for r in json.load(fh)["results"]}
+    print(f"{'benchmark':<24} {'before s':>10} {'after s':>10} {'speedup':>8}")
+    for result in results:
+        before = previous.get(result["name"], {})
+        if "seconds" in result and "seconds" in before:
+            speedup = before["seconds"] / result["seconds"]
+            print(
+                f"{result['name']:<24} {before['seconds']:>10.3f} "
+                f"{result['seconds']:>10.3f} {speedup:>7.2f}x"
+            )
+
+
+def main_benchmark(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark acouachecksum.")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="dataset size factor (default: 1.0)"
+    )
+    parser.add_argument(
+        "--output", default="bench_results.json", help="JSON file for the results"
+    )
+    parser.add_argument(
+        "--only", nargs="*", choices=sorted(BENCHMARKS), help="benchmarks to run"
+    )
+    parser.add_argument("--compare", help="previous JSON results to compare with")
+    args = parser.parse_args(argv)
+
+    names = args.only or list(BENCHMARKS)
+    with tempfile.TemporaryDirectory(prefix="acouabench") as tmp:
+        dataset = make_dataset(Path(tmp), args.scale)
+        results = run_benchmarks(names, dataset)
+    report = {
+        "version": main.version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "scale": args.scale,
+        "results": results,
+    }
+    with open(args.output, "w") as fh:
+        json.dump(report, fh, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_benchmark())
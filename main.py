@@ -1,9 +1,12 @@
 import hashlib
+import io
 import os
 import sys
 import re
+import fnmatch
 import glob
 import pathlib
+import posixpath
 import shutil
 import copy
 import zipfile
@@ -12,6 +15,18 @@ import tarfile
 import rarfile
 import time
 import threading
+import sqlite3
+import struct
+import zlib
+import tempfile
+import json
+import heapq
+import collections
+import logging
+import concurrent.futures
+import contextlib
+import queue
+import multiprocessing
 from pathlib import Path
 from ctypes.wintypes import MAX_PATH
 
@@ -20,21 +35,52 @@ import traceback
 import cProfile
 import pstats
 
-import collections
-
 from typing import Union, Optional
 
-import tkinter as tk
-from tkinter import font, filedialog, ttk
-
+try:
+    import tkinter as tk
+    from tkinter import font, filedialog, ttk
+except ImportError:
+    # Python builds on headless batch nodes often ship without Tk:
+    # the command-line mode does not need it
+    tk = None
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+import argparse
 from functools import partial
 from unicodedata import normalize
 
 version = "0.9.2"
 
 error_file = "ACOUA_md5_errors.txt"
+error_file_header = f"This is the acouachecksum {version} log for errors and warnings. Do not archive.\n"
+
+# Messages for the error file: levels from logging, WARNING by default
+error_logger = logging.getLogger("acouachecksum")
+error_logger.setLevel(logging.INFO)
+error_logger.propagate = False
+error_log_handler = None
+
+# Tracing for debugging, on stderr, off by default: see set_verbosity()
+trace_logger = logging.getLogger("acouachecksum.trace")
+trace_logger.setLevel(logging.WARNING)
+trace_logger.propagate = False
+verbosity = 0
 
 out_file = "ACOUA_md5.md5"
+# algorithms computed on demand beside MD5, in sidecar manifests such as
+# ACOUA_md5.sha256 (same lines, another digest)
+sidecar_algorithms = ("sha1", "sha256", "sha512", "blake2b", "blake2s")
+
+# Checksums of previous runs, to skip unchanged files when re-running
+cache_file = "ACOUA_md5_cache.sqlite"
+# Timings of a run (see RunMetrics), on demand; not part of the dataset
+metrics_file = "ACOUA_md5_metrics.json"
 
 # For archive formats that cannot be processed in memory: no longer used
 # tmp_checksum_folder = "tmp_checksum_folder"
@@ -44,8 +90,56 @@ out_file = "ACOUA_md5.md5"
 libsafe_ingestion_path = "C:/LSLink/ING/ING*******/"
 backslash = "\\"
 
+# The progress display is refreshed at most this often, in seconds
+progress_interval = 0.25
+# Weight of the latest measure in the byte rate shown, smoothed from refresh
+# to refresh (1: no smoothing)
+rate_smoothing = 0.3
+# Called with the size of every block hashed, see set_byte_callback()
+byte_callback = None
+# Files and archives listed in the metrics report as the slowest, see
+# RunMetrics
+metrics_top_n = 20
+# The GUI checks for progress from its checksum thread this often, in ms
+gui_poll_interval = 100
+gui_worker = None
+
+# Read sizes when hashing: 1 MiB blocks, 8 MiB for files of 1 GiB or more
+default_block_size = 2**20
+large_block_size = 2**23
+large_file_size = 2**30
+# per-thread read buffers, see read_buffers()
+thread_buffers = threading.local()
+# Blocks read ahead by a reader thread while the previous ones are hashed,
+# for streams longer than one block (0: read and hash in turn)
+read_ahead_depth = 2
+
+# Loose files are hashed by a pool of threads: hashlib releases the GIL
+# while digesting large buffers, so reads and hashing overlap across files
+default_hash_workers = 4
+
+# Archive decompression is CPU-bound and holds the GIL: archives can be sent
+# to a pool of processes instead (0 = hash archives in the main process).
+# Zips with more members than this are split into ranges of members
+default_archive_processes = 0
+archive_chunk_members = 1000
+# Archives stay open between listing and hashing, up to this many handles:
+# further archives are closed after listing and reopened when hashed
+max_open_archives = 64
+# Manifest lines are sorted by path in memory by runs of this many, spilled
+# to temporary files and merged at the end of the run
+manifest_run_lines = 100000
+
 compressed_extensions = (".zip", ".7z", ".rar", ".tar", ".tar.gz")
+# Nested archives: tars are read as streams, the other formats need random
+# access and are spooled, in memory up to this size then in a temporary file
+streamed_extensions = (".tar", ".tar.gz")
+nested_memory_cap = 2**26
 multipart_hint_extensions = (".z01", ".z001", ".part1.rar")
+# Left out of the listing, with what users add with --exclude (see
+# ExclusionFilter); they are still checksummed inside archives, since the
+# Libsafe sanitizers run before the Archive Extractor
+default_excluded_names = (".DS_Store", "Thumbs.db")
 
 
 def remove_archiver():
@@ -65,7 +159,7 @@ def add_archiver(arch_format):
 def open_archive(ls, extension, parent=None):
     # IN PROGRESS what should archivename be if ls is an archive within another archive?
     if parent is None:
-        print("ls is a", type(ls))
+        debug("open_archive: %s is a %s", ls, type(ls))
         if isinstance(ls, pathlib.PosixPath):
             archivename = os.path.join(str(ls.parents[0]), ls.name)
         elif isinstance(ls, pathlib.WindowsPath):
@@ -102,16 +196,18 @@ def open_archive(ls, extension, parent=None):
         ) as e:
             trace = str(e)
             trace = traceback.format_exc()
-            log_message(trace)
-            log_message(f"{archivename} is not a valid {extension} file.")
+            log_message(trace, logging.ERROR)
+            log_message(
+                f"{archivename} is not a valid {extension} file.", logging.ERROR
+            )
             return (archivename, None)
     else:
-        print(ls)
+        debug("open_archive: %s", ls)
         if isinstance(ls, zipfile.ZipInfo):
             try:
                 subarch = zipfile.ZipFile(parent.open(ls, mode="r"), mode="r")
                 archivename = f"{arch_filename(parent)}##{arch_filename(ls)}]"
-                print(archivename, subarch)
+                debug("open_archive: %s", archivename)
                 return (archivename, subarch)
             except zipfile.BadZipFile:
                 return (None, None)
@@ -191,9 +287,326 @@ def arch_object_filename(arch_object):
         return arch_object.filename
 
 
-def log_message(message):
-    with open(error_file, "a") as f_err:
-        f_err.write(f"{message}\n")
+def arch_object_size(arch_object):
+    """Uncompressed size of an archive member."""
+    if isinstance(arch_object, zipfile.ZipInfo):
+        return arch_object.file_size
+    if isinstance(arch_object, py7zr.FileInfo):
+        return arch_object.uncompressed or 0
+    if isinstance(arch_object, tarfile.TarInfo):
+        return arch_object.size
+    if isinstance(arch_object, rarfile.RarInfo):
+        return arch_object.file_size
+    return 0
+
+
+class ArchiveSession:
+    """An archive opened once, for both the listing and the hashing phase.
+
+    Keeps the handle and the member list built at listing time, so that the
+    archive directory is not read and parsed a second time for hashing.
+    close() releases the handle but keeps the member list: open() reopens
+    the archive if it is needed again. With nested_depth > 0, leaves lists
+    the files once the nested archives are expanded (see nested_entries).
+    """
+
+    def __init__(self, archivename, extension, signature=None, nested_depth=0):
+        self.extension = extension
+        self.signature = signature
+        (self.archivename, self.archive) = open_archive(archivename, extension)
+        self.valid = self.archive is not None
+        self.infolist = arch_content(self.archive)
+        files = [info for info in self.infolist if not isdir(info)]
+        # a name may occur twice: members is kept as listed, for collisions
+        self.members = [arch_object_filename(info) for info in files]
+        self.member_sizes = {
+            arch_object_filename(info): arch_object_size(info) for info in files
+        }
+        self.size = sum(arch_object_size(info) for info in files)
+        self.nested_depth = nested_depth
+        self.nested = {}
+        if self.valid:
+            self.nested = nested_leaves(self.archive, self.members, nested_depth)
+        self.leaves = self.expand(self.members)
+
+    def expand(self, members):
+        """The files of members, with nested archives replaced by theirs."""
+        return [leaf for name in members for leaf in self.nested.get(name, [name])]
+
+    def open(self):
+        if self.archive is None and self.valid:
+            (_, self.archive) = open_archive(self.archivename, self.extension)
+        return self.archive
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class BufferedLogHandler(logging.Handler):
+    """Appends the messages of a run to the error file in batches.
+
+    The file is opened once per batch instead of once per message: when
+    capacity messages are waiting, when flush_interval seconds have passed
+    since the last write, and on flush() or close(). Thread-safe, since
+    logging.Handler runs emit() and flush() under the handler lock.
+    """
+
+    def __init__(self, path, capacity=1000, flush_interval=2.0):
+        super().__init__()
+        self.path = path
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.setFormatter(logging.Formatter("%(message)s"))
+
+    def emit(self, record):
+        try:
+            self.buffer.append(self.format(record) + "\n")
+        except Exception:
+            self.handleError(record)
+            return
+        if (
+            len(self.buffer) >= self.capacity
+            or time.monotonic() - self.last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.buffer:
+                with open(self.path, "a") as f_err:
+                    f_err.writelines(self.buffer)
+                self.buffer.clear()
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        super().close()
+
+
+def start_error_log(path):
+    """Buffer the messages of log_message() for path, until stop_error_log()."""
+    global error_log_handler
+    stop_error_log()
+    error_log_handler = BufferedLogHandler(os.path.abspath(path))
+    error_logger.addHandler(error_log_handler)
+
+
+def stop_error_log():
+    """Write the buffered messages, then log directly to error_file again."""
+    global error_log_handler
+    if error_log_handler is not None:
+        error_logger.removeHandler(error_log_handler)
+        error_log_handler.close()
+        error_log_handler = None
+
+
+def log_message(message, level=logging.WARNING):
+    """Log message to the error file, if error_logger takes its level.
+
+    During a run, messages are buffered (see start_error_log); otherwise,
+    e.g. in archive pool processes (see init_archive_worker), they are
+    appended at once.
+    """
+    if error_log_handler is not None:
+        error_logger.log(level, message)
+    elif error_logger.isEnabledFor(level):
+        with open(error_file, "a") as f_err:
+            f_err.write(f"{message}\n")
+
+
+def set_verbosity(level):
+    """Tracing detail: 0 none, 1 phases and their timings, 2 every file too.
+
+    Also the initializer of archive pool processes, so that they trace alike.
+    """
+    global verbosity
+    verbosity = level
+    trace_logger.setLevel(
+        logging.WARNING if level <= 0 else logging.INFO if level == 1 else logging.DEBUG
+    )
+    if level > 0 and not trace_logger.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(
+            logging.Formatter("%(relativeCreated)9.0f ms %(processName)s %(message)s")
+        )
+        trace_logger.addHandler(handler)
+
+
+def debug(message, *args):
+    """Per-file detail, formatted lazily: only costs a level check when off."""
+    trace_logger.debug(message, *args)
+
+
+@contextlib.contextmanager
+def trace_span(name, level=logging.INFO):
+    """Time the enclosed phase, traced when its level is enabled.
+
+    Phases (level INFO and above) are also added to run_metrics.
+    """
+    traced = trace_logger.isEnabledFor(level)
+    if traced:
+        trace_logger.log(level, "%s: start", name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if level >= logging.INFO:
+            run_metrics.add_phase(name, seconds)
+        if traced:
+            trace_logger.log(level, "%s: %.3f s", name, seconds)
+
+
+def peak_rss_kib(children=False):
+    """Peak resident memory in KiB of this process, or with children=True,
+    of its largest terminated child process (e.g. of a pool); None if it
+    cannot be measured."""
+    if not children:
+        try:
+            # Linux: unlike ru_maxrss, VmHWM is not inherited from the parent
+            with open("/proc/self/status") as fh:
+                for line in fh:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+    if resource is not None:
+        who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+        peak = resource.getrusage(who).ru_maxrss
+        # bytes on macOS, KiB on Linux
+        return peak // 1024 if sys.platform == "darwin" else peak
+    if children:
+        return None
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().peak_wset // 1024
+    except (ImportError, AttributeError):
+        return None
+
+
+class RunMetrics:
+    """Where the time of a run goes, for tuning block sizes and workers.
+
+    phases holds the wall time (and bytes, if any) of each phase: those of
+    trace_span(), and finer ones of the listing and of the manifest output.
+    work holds the time spent hashing by kind of work, e.g. loose files or
+    the archives of a format, summed over the workers, with the bytes
+    hashed. The top slowest files and archives are kept as well.
+    write() saves them as JSON, with the peak memory of the run.
+    """
+
+    def __init__(self, top=None):
+        self.top = top or metrics_top_n
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.phases = {}
+            self.work = {}
+            # min-heap of (seconds, kind, path, bytes): the slowest on top
+            self.slowest = []
+
+    @contextlib.contextmanager
+    def phase(self, name, nbytes=0):
+        """Add the wall time of the enclosed code to phase name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start, nbytes)
+
+    def add_phase(self, name, seconds, nbytes=0):
+        with self.lock:
+            phase = self.phases.setdefault(name, {"seconds": 0.0, "bytes": 0})
+            phase["seconds"] += seconds
+            phase["bytes"] += nbytes
+
+    def add_work(self, name, kind, path, seconds, nbytes):
+        """path (a file, or an archive) of the given kind took seconds to hash."""
+        with self.lock:
+            work = self.work.setdefault(
+                name, {"seconds": 0.0, "bytes": 0, "count": 0}
+            )
+            work["seconds"] += seconds
+            work["bytes"] += nbytes
+            work["count"] += 1
+            entry = (seconds, kind, path, nbytes)
+            if len(self.slowest) < self.top:
+                heapq.heappush(self.slowest, entry)
+            elif entry > self.slowest[0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def report(self):
+        def rated(figures):
+            figures = dict(figures, seconds=round(figures["seconds"], 4))
+            if figures["bytes"] and figures["seconds"] > 0:
+                figures["mb_per_s"] = round(
+                    figures["bytes"] / 2**20 / figures["seconds"], 2
+                )
+            return figures
+
+        with self.lock:
+            slowest = sorted(self.slowest, reverse=True)
+            return {
+                "version": version,
+                "seconds": round(time.perf_counter() - self.started, 4),
+                "phases": {name: rated(f) for name, f in self.phases.items()},
+                "work": {name: rated(f) for name, f in self.work.items()},
+                "slowest": [
+                    {
+                        "kind": kind,
+                        "path": path,
+                        "seconds": round(seconds, 4),
+                        "bytes": nbytes,
+                    }
+                    for seconds, kind, path, nbytes in slowest
+                ],
+                "peak_rss_kib": peak_rss_kib(),
+                "peak_rss_kib_children": peak_rss_kib(children=True),
+            }
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(self.report(), fh, indent=2, ensure_ascii=False)
+
+
+# Metrics of the current run, reset by start_run()
+run_metrics = RunMetrics()
+
+
+def init_archive_worker(depth, level):
+    """Archive pool process initializer: settings of the main process."""
+    global error_log_handler
+    set_read_ahead(depth)
+    set_verbosity(level)
+    # a forked process inherits the callback, but not the run it reports on
+    set_byte_callback(None)
+    # nor the error log: pool processes end without flushing it, and its
+    # buffer holds the main process's messages. Dropped unflushed, so that
+    # log_message() appends at once
+    if error_log_handler is not None:
+        error_logger.removeHandler(error_log_handler)
+        error_log_handler = None
+
+
+def set_byte_callback(callback):
+    """Process-wide hook called with the size of each block hashed, as it is
+    read (None: no hook), e.g. ProgressReporter.count_bytes."""
+    global byte_callback
+    byte_callback = callback
 
 
 def is_cp850(s):
@@ -207,15 +620,372 @@ def is_cp850(s):
         return False
 
 
+class ConsoleProgress:
+    """Headless replacement for the Tk progress label and root window.
+
+    Provides the config(text=...) and update() calls that the checksum
+    pipeline makes on Tk widgets, and writes each new status to a stream.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream if stream is not None else sys.stderr
+        self.last_text = None
+
+    def config(self, text):
+        if text != self.last_text:
+            self.last_text = text
+            print(text, file=self.stream, flush=True)
+
+    def update(self):
+        pass
+
+
+class NullProgress:
+    """Progress sink discarding every message, e.g. in pool workers."""
+
+    def config(self, text):
+        pass
+
+    def update(self):
+        pass
+
+
+class QueuedProgress:
+    """Progress sink for a worker thread: Tk is not thread-safe, so each
+    status is posted to a queue that the Tk main loop drains with after()."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def config(self, text):
+        self.events.put(("progress", text))
+
+    def update(self):
+        pass
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+class ProgressReporter:
+    """Time-throttled progress of a phase, shown on a progress sink.
+
+    Counts files and bytes, and refreshes the sink (a Tk label and root
+    window, or ConsoleProgress) at most once per interval, with the byte
+    and file rates and an ETA based on the bytes left. Bytes come either
+    with advance(), or from the hashing engine through count_bytes() as
+    they are read, so that the progress of a huge file shows. The byte rate
+    is smoothed from refresh to refresh (rate_smoothing). With status_path,
+    the same figures and the duration of each phase are also written there
+    as JSON at each refresh. config() and update() make it a sink itself,
+    for handleArchive(): see tk_progress_update().
+    """
+
+    def __init__(
+        self,
+        progress_info,
+        tkroot,
+        interval=None,
+        clock=time.monotonic,
+        status_path=None,
+    ):
+        self.progress_info = progress_info
+        self.tkroot = tkroot
+        self.interval = progress_interval if interval is None else interval
+        self.clock = clock
+        self.status_path = status_path
+        self.label = "Progress"
+        self.total_files = self.total_bytes = 0
+        self.files = self.start_files = self.bytes = 0
+        self.started = clock()
+        self.last_refresh = None
+        # count_bytes() may be called from hashing threads
+        self.lock = threading.Lock()
+        self.thread = threading.current_thread()
+        self.phase = None
+        self.phases = {}
+        self.rate = None
+        (self.rate_time, self.rate_bytes) = (self.started, 0)
+
+    def start(self, label, total_files=0, total_bytes=0, files=0):
+        """Start a phase; without totals, only the file count is shown."""
+        self.end_phase()
+        self.phase = self.label = label
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files = self.start_files = files
+        self.bytes = 0
+        self.started = self.clock()
+        self.last_refresh = None
+        self.rate = None
+        (self.rate_time, self.rate_bytes) = (self.started, 0)
+        self.refresh(force=True)
+
+    def end_phase(self):
+        if self.phase is not None:
+            self.phases[self.phase] = self.clock() - self.started
+            self.phase = None
+
+    def advance(self, files, nbytes=0):
+        """files: files done so far in the run, nbytes: bytes since last call."""
+        self.files = files
+        if nbytes:
+            with self.lock:
+                self.bytes += nbytes
+        self.refresh()
+
+    def count_bytes(self, nbytes):
+        """nbytes more were hashed: may be called from any thread, but only
+        refreshes the sink from the thread that created the reporter."""
+        with self.lock:
+            self.bytes += nbytes
+        if threading.current_thread() is self.thread:
+            self.refresh()
+
+    def refresh(self, force=False):
+        now = self.clock()
+        if not force and self.last_refresh is not None:
+            if now - self.last_refresh < self.interval:
+                return
+        self.last_refresh = now
+        if now > self.rate_time:
+            rate = (self.bytes - self.rate_bytes) / (now - self.rate_time)
+            if self.rate is not None:
+                rate = rate_smoothing * rate + (1 - rate_smoothing) * self.rate
+            self.rate = rate
+            (self.rate_time, self.rate_bytes) = (now, self.bytes)
+        self.config(self.message(now - self.started))
+        if self.status_path is not None:
+            self.write_status("running", now - self.started)
+
+    def rates(self, elapsed):
+        """(byte rate, file rate, ETA in seconds) of the phase, or None.
+
+        With a byte total, the ETA follows the bytes, even before the first
+        file is done (e.g. a single huge file); otherwise, the files.
+        """
+        by_bytes = self.total_bytes and self.bytes
+        if elapsed <= 0 or not (by_bytes or self.files > self.start_files):
+            return None
+        byte_rate = self.bytes / elapsed if self.rate is None else self.rate
+        file_rate = (self.files - self.start_files) / elapsed
+        if by_bytes and byte_rate > 0:
+            eta = max(0, self.total_bytes - self.bytes) / byte_rate
+        elif file_rate > 0:
+            eta = max(0, self.total_files - self.files) / file_rate
+        else:
+            return None
+        return (byte_rate, file_rate, eta)
+
+    def message(self, elapsed):
+        if not self.total_files:
+            return f"{self.label}: {self.files} files"
+        text = f"{self.label}: {self.files}/{self.total_files}"
+        if self.total_bytes:
+            text += f" ({100 * min(self.bytes, self.total_bytes) // self.total_bytes}%)"
+        rates = self.rates(elapsed)
+        if rates is None:
+            return text
+        (byte_rate, file_rate, eta) = rates
+        text += f", {byte_rate / 2**20:.1f} MB/s, {file_rate:.0f} files/s"
+        return text + f", ETA {format_duration(eta)}"
+
+    def write_status(self, state, elapsed):
+        """Write the status file; replaced at once, never seen half-written."""
+        (byte_rate, _, eta) = self.rates(elapsed) or (None, None, None)
+        status = {
+            "state": state,
+            "phase": self.label,
+            "files": self.files,
+            "total_files": self.total_files,
+            "bytes": self.bytes,
+            "total_bytes": self.total_bytes,
+            "bytes_per_second": None if byte_rate is None else round(byte_rate),
+            "eta_seconds": None if eta is None else round(eta),
+            "elapsed_seconds": round(elapsed, 3),
+            "phases": {label: round(t, 3) for label, t in self.phases.items()},
+            "updated": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        }
+        with open(self.status_path + ".tmp", "w") as fh:
+            json.dump(status, fh, indent=1)
+        os.replace(self.status_path + ".tmp", self.status_path)
+
+    def finish(self, state="done"):
+        """End of the run: write the final status (state: "done", or "failed"
+        if the run was interrupted); returns how long each phase took."""
+        elapsed = self.clock() - self.started
+        self.end_phase()
+        if self.status_path is not None:
+            self.write_status(state, elapsed)
+        return ", ".join(
+            f"{label.lower()} {format_duration(t)}" for label, t in self.phases.items()
+        )
+
+    def config(self, text):
+        self.progress_info.config(text=text)
+        self.tkroot.update()
+
+    def update(self):
+        pass
+
+
 def tk_progress_update(
     total_files, progress, progress_update_frequency, progress_info, tkroot
 ):
-    if progress % progress_update_frequency == 0:
+    if isinstance(progress_info, ProgressReporter):
+        # throttled by time rather than by progress_update_frequency
+        progress_info.advance(progress)
+    elif progress % progress_update_frequency == 0:
         progress_msg = f"Progress: {progress}/{total_files}"
         progress_info.config(text=progress_msg)
         tkroot.update()
 
 
+class StoredZipMember(io.RawIOBase):
+    """Data of a ZIP_STORED zip member, read straight from the archive file.
+
+    There is nothing to decompress: the bytes stored are the member's, and
+    they are read in large blocks from where the local header says they
+    start. The CRC-32 is still checked at the end, as ZipFile.open() does.
+    """
+
+    def __init__(self, archive, info):
+        self.fp = archive.fp
+        self.info = info
+        self.fp.seek(info.header_offset)
+        header = self.fp.read(zipfile.sizeFileHeader)
+        fields = struct.unpack(zipfile.structFileHeader, header)
+        if fields[0] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile("Bad magic number for file header")
+        # the local header's name and extra field lengths: its own, not
+        # necessarily those of the central directory
+        self.pos = info.header_offset + zipfile.sizeFileHeader + sum(fields[-2:])
+        self.end = self.pos + info.compress_size
+        self.size = info.compress_size
+        self.crc = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), self.end - self.pos)
+        if n <= 0:
+            if self.crc != self.info.CRC:
+                raise zipfile.BadZipFile(f"Bad CRC-32 for file {self.info.filename!r}")
+            return 0
+        self.fp.seek(self.pos)
+        data = self.fp.read(n)
+        if not data:
+            raise EOFError(f"{self.info.filename} is truncated")
+        n = len(data)
+        b[:n] = data
+        self.pos += n
+        self.crc = zlib.crc32(data, self.crc)
+        return n
+
+
+def zip_member(archive, info):
+    """Readable stream of a zip member: raw stored data when possible."""
+    if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+        return StoredZipMember(archive, info)
+    # compressed or encrypted
+    return archive.open(info, "r")
+
+
+class DigestIO(py7zr.io.Py7zIO):
+    """py7zr writer hashing decompressed data as it arrives, then dropping it."""
+
+    def __init__(self, filename, algorithms=("md5",)):
+        self.filename = filename
+        self.hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self._size = 0
+
+    def write(self, s):
+        self._size += len(s)
+        for m in self.hashes.values():
+            m.update(s)
+        if byte_callback is not None:
+            byte_callback(len(s))
+        return len(s)
+
+    def read(self, size=None):
+        return b""
+
+    def seek(self, offset, whence=0):
+        return 0
+
+    def flush(self):
+        pass
+
+    def size(self):
+        return self._size
+
+    def hexdigest(self):
+        return self.hashes["md5"].hexdigest()
+
+    def digests(self):
+        return {algorithm: m.hexdigest() for algorithm, m in self.hashes.items()}
+
+
+class SpoolIO(py7zr.io.Py7zIO):
+    """py7zr writer keeping a member, e.g. a nested archive, in a spool file."""
+
+    def __init__(self, filename, max_size=nested_memory_cap):
+        self.filename = filename
+        self.buffer = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self._size = 0
+
+    def write(self, s):
+        self._size += len(s)
+        return self.buffer.write(s)
+
+    def read(self, size=None):
+        return self.buffer.read(-1 if size is None else size)
+
+    def seek(self, offset, whence=0):
+        return self.buffer.seek(offset, whence)
+
+    def flush(self):
+        self.buffer.flush()
+
+    def size(self):
+        return self._size
+
+    def close(self):
+        self.buffer.close()
+
+
+class DigestIOFactory(py7zr.io.WriterFactory):
+    """py7zr writer factory: one DigestIO per extracted member, by filename.
+
+    Members named in spooled get a SpoolIO instead; together, they keep at
+    most nested_memory_cap bytes in memory.
+    """
+
+    def __init__(self, algorithms=("md5",), spooled=()):
+        self.algorithms = algorithms
+        self.spooled = set(spooled)
+        self.products = {}
+
+    def create(self, filename):
+        if filename in self.spooled:
+            max_size = nested_memory_cap // len(self.spooled)
+            product = SpoolIO(filename, max_size)
+        else:
+            product = DigestIO(filename, self.algorithms)
+        self.products[filename] = product
+        return product
+
+
+def member_checksums(fh, algorithms):
+    """MD5 of fh if algorithms is None, else the {algorithm: digest} dict."""
+    if algorithms is None:
+        return md5Checksum2(fh)
+    return checksums(fh, algorithms)
+
+
 def handleArchive(
     filelist,
     ziparchive,
@@ -224,112 +994,1322 @@ def handleArchive(
     progress_update_frequency,
     progress_info,
     tkroot,
+    algorithms=None,
+    depth=0,
 ):
+    # With algorithms, e.g. ("md5", "sha256"), md5list holds the dict of
+    # digests of each member instead of its MD5, all from a single read.
+    # With depth > 0, the members that are archives themselves are replaced
+    # by the files they hold (see nested_entries). filelist=None: all files.
     md5list = []
     if ziparchive is None:
         # filelist will be just a filename, i.e. a string
         filePath = filelist
         progress += 1
-        print("processing <no_archive_here> #", filePath)
-        element = open(filePath, "rb")
-        md5list.append((filePath, md5Checksum2(element)))
+        debug("processing <no_archive_here> # %s", filePath)
+        with open(filePath, "rb") as element:
+            md5list.append((filePath, member_checksums(element, algorithms)))
         tk_progress_update(
             total_files, progress, progress_update_frequency, progress_info, tkroot
         )
-    elif isinstance(ziparchive, py7zr.SevenZipFile):
-        # Use the BytesIO part of the response, the filename can be discarded
-        no_buffer_required = False
+        return (md5list, progress)
+    if filelist is None and not isinstance(ziparchive, tarfile.TarFile):
+        filelist = [
+            arch_object_filename(info)
+            for info in arch_content(ziparchive)
+            if not isdir(info)
+        ]
+    if isinstance(ziparchive, py7zr.SevenZipFile):
+        # Members are hashed while py7zr decompresses them: memory use does
+        # not depend on the size of the archive or of its members
         ziparchive.reset()
-        # 4 TiB is a nice arbitrary limit
-        factory = py7zr.io.BytesIOFactory(2**42)
-        ziparchive.extractall(factory=factory)
-        print(factory.products)
+        nested = {name for name in filelist if nested_extension(name, depth)}
+        factory = DigestIOFactory(algorithms or ("md5",), spooled=nested)
+        ziparchive.extract(targets=filelist, factory=factory)
         for filePath in filelist:
-            progress += 1
-            print(filePath)
-            print(ziparchive.header.__dict__)
-            print("processing", ziparchive.archiveinfo().filename, "#", filePath)
-            element = factory.products[filePath]
-            md5list.append((filePath, md5Checksum2(element)))
+            debug("processing %s # %s", ziparchive.filename, filePath)
+            product = factory.products[filePath]
+            if filePath in nested:
+                product.seek(0)
+                entries = nested_entries(filePath, product, depth, algorithms)
+                product.close()
+            elif algorithms is None:
+                entries = [(filePath, product.hexdigest())]
+            else:
+                entries = [(filePath, product.digests())]
+            md5list.extend(entries)
+            progress += len(entries)
             tk_progress_update(
                 total_files, progress, progress_update_frequency, progress_info, tkroot
             )
         # ziparchive.reset()
     elif isinstance(ziparchive, tarfile.TarFile):
+        # A single pass in header order, hashing each member from the TarInfo
+        # at hand rather than looking it up by name again: the underlying
+        # stream, even a gzip/bz2/xz decompressor, only moves forward
+        wanted = None if filelist is None else set(filelist)
+        links = []
         for member in ziparchive:
-            print(member.name)
-            if member.name in filelist:
-                print(" is in filelist")
-                progress += 1
-                element = ziparchive.extractfile(member.name)
-                md5list.append((member.name, md5Checksum2(element)))
-                tk_progress_update(
-                    total_files,
-                    progress,
-                    progress_update_frequency,
-                    progress_info,
-                    tkroot,
+            if member.isdir() or (wanted is not None and member.name not in wanted):
+                continue
+            debug("processing %s # %s", ziparchive.name, member.name)
+            if member.isreg():
+                element = ziparchive.extractfile(member)
+                entries = member_entries(member.name, element, depth, algorithms)
+            elif member.islnk() or member.issym():
+                # the data of a link is an earlier member's: see below
+                links.append((len(md5list), member))
+                entries = [(member.name, None)]
+            else:
+                log_message(f"{member.name} in {ziparchive.name} is not a file")
+                entries = []
+            md5list.extend(entries)
+            progress += max(1, len(entries))
+            tk_progress_update(
+                total_files,
+                progress,
+                progress_update_frequency,
+                progress_info,
+                tkroot,
+            )
+        if links:
+            hashed = dict(md5list)
+            for index, member in links:
+                digests = hashed.get(tar_link_target(member))
+                if digests is None:
+                    # target outside the hashed members: read it (backwards)
+                    try:
+                        element = ziparchive.extractfile(member)
+                    except tarfile.StreamError:
+                        # nested tars are streams: there is no going back
+                        log_message(f"{member.name}: link target not found")
+                        continue
+                    digests = member_checksums(element, algorithms)
+                md5list[index] = (member.name, digests)
+            md5list = [entry for entry in md5list if entry[1] is not None]
+    elif isinstance(ziparchive, zipfile.ZipFile):
+        # Members are hashed from their ZipInfo, in the order of their data in
+        # the archive file, so that it is read sequentially; md5list keeps the
+        # order of filelist
+        infos = [ziparchive.getinfo(name) for name in filelist]
+        hashed = [None] * len(infos)
+        for index in sorted(range(len(infos)), key=lambda i: infos[i].header_offset):
+            info = infos[index]
+            debug("processing %s # %s", ziparchive.filename, info.filename)
+            with zip_member(ziparchive, info) as element:
+                hashed[index] = member_entries(
+                    info.filename, element, depth, algorithms
                 )
+            progress += len(hashed[index])
+            tk_progress_update(
+                total_files, progress, progress_update_frequency, progress_info, tkroot
+            )
+        md5list = [entry for entries in hashed for entry in entries]
     else:
         for filePath in filelist:
-            progress += 1
-            print("processing", ziparchive.filename, "#", filePath)
-            element = ziparchive.open(filePath, "r")
-            md5list.append((filePath, md5Checksum2(element)))
+            debug("processing %s # %s", ziparchive.filename, filePath)
+            with ziparchive.open(filePath, "r") as element:
+                entries = member_entries(filePath, element, depth, algorithms)
+            md5list.extend(entries)
+            progress += len(entries)
             tk_progress_update(
                 total_files, progress, progress_update_frequency, progress_info, tkroot
             )
     return (md5list, progress)
 
 
+def nested_extension(name, depth):
+    """Extension of a member to look into as an archive at depth, or None."""
+    if depth > 0:
+        for extension in compressed_extensions:
+            if name.endswith(extension):
+                return extension
+    return None
+
+
+class DigestReader:
+    """Read-only stream hashing the data read from fh, as long as hashes is set."""
+
+    def __init__(self, fh, algorithms):
+        self.fh = fh
+        self.hashes = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+
+    def read(self, size=-1):
+        data = self.fh.read(size)
+        for m in self.hashes.values():
+            m.update(data)
+        return data
+
+    def digests(self):
+        """Digests of the whole of fh: what was not read yet is read first."""
+        while self.read(default_block_size):
+            pass
+        return {algorithm: m.hexdigest() for algorithm, m in self.hashes.items()}
+
+
+def spool(fh):
+    """Copy of a member stream with random access, for nested archives."""
+    buffer = tempfile.SpooledTemporaryFile(max_size=nested_memory_cap)
+    shutil.copyfileobj(fh, buffer, default_block_size)
+    buffer.seek(0)
+    return buffer
+
+
+nested_archive_errors = (
+    zipfile.BadZipFile,
+    py7zr.exceptions.Bad7zFile,
+    rarfile.Error,
+    tarfile.TarError,
+    EOFError,
+)
+# reading a member that holds a nested archive, when listing it
+nested_read_errors = nested_archive_errors + (
+    py7zr.exceptions.ArchiveError,
+    zlib.error,
+    OSError,
+)
+
+
+def open_nested(fh, extension):
+    """Archive read from a member stream: tars as streams, others spooled."""
+    if extension in streamed_extensions:
+        return tarfile.open(fileobj=fh, mode="r|*")
+    if extension == ".zip":
+        return zipfile.ZipFile(fh, mode="r")
+    if extension == ".7z":
+        return py7zr.SevenZipFile(fh, mode="r")
+    return rarfile.RarFile(fh, mode="r")
+
+
+def member_entries(name, fh, depth, algorithms):
+    """(name, checksums) of an archive member read from fh; with depth > 0
+    and a nested archive, of the files it holds (see nested_entries)."""
+    if nested_extension(name, depth) is not None:
+        return nested_entries(name, fh, depth, algorithms)
+    return [(name, member_checksums(fh, algorithms))]
+
+
+def nested_entries(name, fh, depth, algorithms):
+    """Checksums of the files of the nested archive member name, read from fh.
+
+    Files are named by their path once the archive is extracted next to it,
+    and archives among them are expanded down to depth - 1 more levels.
+    If it is not a valid archive, the member is checksummed as a file.
+    """
+    extension = nested_extension(name, depth)
+    if extension in streamed_extensions:
+        # hashed while the tar header is read, in case it is not one
+        source = DigestReader(fh, algorithms or ("md5",))
+    else:
+        source = spool(fh)
+    try:
+        inner = open_nested(source, extension)
+    except nested_archive_errors:
+        if isinstance(source, DigestReader):
+            digests = source.digests()
+            return [(name, digests["md5"] if algorithms is None else digests)]
+        with source:
+            source.seek(0)
+            return [(name, member_checksums(source, algorithms))]
+    if isinstance(source, DigestReader):
+        source.hashes = {}
+    folder = posixpath.dirname(name)
+    try:
+        sink = NullProgress()
+        md5list, _ = handleArchive(
+            None, inner, 0, 0, 1, sink, sink, algorithms, depth - 1
+        )
+    finally:
+        inner.close()
+        if not isinstance(source, DigestReader):
+            source.close()
+    return [(posixpath.join(folder, member), digests) for member, digests in md5list]
+
+
+def member_streams(archive, names):
+    """(name, stream) of the given members, reading the archive forward."""
+    if isinstance(archive, py7zr.SevenZipFile):
+        archive.reset()
+        factory = DigestIOFactory(spooled=names)
+        archive.extract(targets=names, factory=factory)
+        for name in names:
+            product = factory.products[name]
+            product.seek(0)
+            with contextlib.closing(product):
+                yield name, product
+    elif isinstance(archive, tarfile.TarFile):
+        wanted = set(names)
+        for member in archive:
+            if member.isreg() and member.name in wanted:
+                yield member.name, archive.extractfile(member)
+    else:
+        for name in names:
+            with archive.open(name, "r") as fh:
+                yield name, fh
+
+
+def nested_leaves(archive, members, depth):
+    """{member: files it holds} for the nested archives among members of
+    archive (down to depth levels), named as nested_entries names them.
+    A member that cannot be read is logged and left out: it is listed as
+    a file, and the hashing step logs its error."""
+    nested = [name for name in members if nested_extension(name, depth)]
+    leaves = {}
+    if not nested:
+        return leaves
+    streams = member_streams(archive, nested)
+    try:
+        for name, fh in streams:
+            try:
+                leaves[name] = nested_names(name, fh, depth)
+            except nested_read_errors as e:
+                log_message(f"Cannot list {name}: {e}: checksummed as a file")
+    except nested_read_errors as e:
+        # the archive cannot be read any further
+        unread = ", ".join(name for name in nested if name not in leaves)
+        log_message(f"Cannot list {unread}: {e}: checksummed as files")
+    finally:
+        streams.close()
+    return leaves
+
+
+def nested_names(name, fh, depth):
+    """Listing counterpart of nested_entries: the names of its entries."""
+    extension = nested_extension(name, depth)
+    source = fh if extension in streamed_extensions else spool(fh)
+    try:
+        inner = open_nested(source, extension)
+    except nested_archive_errors:
+        log_message(f"{name} is not a valid {extension} file: checksummed as a file")
+        return [name]
+    folder = posixpath.dirname(name)
+    try:
+        if isinstance(inner, tarfile.TarFile):
+            # a stream: members are looked into as they come
+            names = []
+            for member in inner:
+                if member.isdir():
+                    continue
+                if member.isreg() and nested_extension(member.name, depth - 1):
+                    element = inner.extractfile(member)
+                    names += nested_names(member.name, element, depth - 1)
+                else:
+                    names.append(member.name)
+        else:
+            members = [
+                arch_object_filename(info)
+                for info in arch_content(inner)
+                if not isdir(info)
+            ]
+            expanded = nested_leaves(inner, members, depth - 1)
+            names = [leaf for name in members for leaf in expanded.get(name, [name])]
+    finally:
+        inner.close()
+        if source is not fh:
+            source.close()
+    return [posixpath.join(folder, member) for member in names]
+
+
+def tar_link_target(member):
+    """Name of the member whose data a tar hard or symbolic link points to."""
+    if member.islnk():
+        return member.linkname
+    return posixpath.normpath(
+        posixpath.join(posixpath.dirname(member.name), member.linkname)
+    )
+
+
+def read_size(fh):
+    """Size of the reads used to hash fh.
+
+    For real files and stored zip members, adapted to the size: small ones
+    are read in one call, multi-GB ones in large blocks, always a multiple of
+    the filesystem block size. Other streams (compressed archive members,
+    memory) use default_block_size.
+    """
+    if isinstance(fh, StoredZipMember):
+        # a range of the archive file
+        (size, fs_block) = (fh.size, 4096)
+    elif not isinstance(getattr(fh, "raw", fh), io.FileIO):
+        return default_block_size
+    else:
+        try:
+            st = os.fstat(fh.fileno())
+        except OSError:
+            return default_block_size
+        # st_blksize is not available on Windows
+        (size, fs_block) = (st.st_size, getattr(st, "st_blksize", 0) or 4096)
+    if size >= large_file_size:
+        size = large_block_size
+    elif size <= default_block_size:
+        # one more byte, so that a small file is read to its end in one call,
+        # without read-ahead, even when its size is a multiple of fs_block
+        size += 1
+    else:
+        size = default_block_size
+    return max(fs_block, -(-size // fs_block) * fs_block)
+
+
+def read_buffers(size, count):
+    """count writable views of size bytes, reused by successive calls in a thread."""
+    buffers = getattr(thread_buffers, "buffers", [])
+    if len(buffers) < count or len(buffers[0]) < size:
+        buffers = [bytearray(size) for _ in range(max(count, len(buffers)))]
+        thread_buffers.buffers = buffers
+    return [memoryview(buffer)[:size] for buffer in buffers[:count]]
+
+
+def read_buffer(size):
+    """A writable view of size bytes, reused by successive calls in a thread."""
+    return read_buffers(size, 1)[0]
+
+
+def set_read_ahead(depth):
+    """Process-wide read-ahead depth; also the initializer of archive processes."""
+    global read_ahead_depth
+    read_ahead_depth = depth
+
+
+def read_ahead(fh, free, filled, stop):
+    """Reader thread: fill the free buffers from fh, in order, until EOF."""
+    try:
+        while True:
+            buffer = free.get()
+            if stop.is_set():
+                return
+            n = fh.readinto(buffer)
+            filled.put((buffer, n))
+            if not n:
+                return
+    except BaseException as e:
+        filled.put((e, None))
+
+
 def md5Checksum2(fh):
-    # blocksize = 8192
-    # switch to 1MB blocks to improve performance
-    blocksize = 2**20
+    return checksums(fh, ("md5",))["md5"]
 
-    no_buffer_required = True
-    buffer_blocks = 256
 
-    m = hashlib.md5()
-    k = 0
-    while True:
-        if no_buffer_required:
-            data = fh.read(blocksize)
-            k += 1
+def checksums(fh, algorithms):
+    """Hex digests of fh for each hashlib algorithm, from a single read pass."""
+    hashes = [hashlib.new(algorithm) for algorithm in algorithms]
+    callback = byte_callback
+
+    def update(block):
+        for m in hashes:
+            m.update(block)
+        if callback is not None:
+            callback(len(block))
+
+    # Blocks are read into buffers reused from file to file, instead of
+    # allocating a new bytes object for each read
+    if not hasattr(fh, "readinto"):
+        while True:
+            data = fh.read(default_block_size)
             if not data:
                 break
-            m.update(data)
+            update(data)
+    else:
+        buffers = read_buffers(read_size(fh), 1 + read_ahead_depth)
+        n = fh.readinto(buffers[0])
+        if n == len(buffers[0]) and read_ahead_depth > 0:
+            # more than one block: the next ones are read by another thread
+            # while this one hashes (hashlib releases the GIL), through a
+            # bounded queue of the reused buffers
+            free, filled = queue.Queue(), queue.Queue()
+            for buffer in buffers[1:]:
+                free.put(buffer)
+            stop = threading.Event()
+            reader = threading.Thread(
+                target=read_ahead, args=(fh, free, filled, stop), daemon=True
+            )
+            reader.start()
+            try:
+                update(buffers[0])
+                free.put(buffers[0])
+                while True:
+                    buffer, n = filled.get()
+                    if n is None:
+                        raise buffer
+                    if not n:
+                        break
+                    update(buffer[:n])
+                    free.put(buffer)
+            finally:
+                # never leave the reader blocked, nor reading a closed file
+                stop.set()
+                free.put(None)
+                reader.join()
         else:
-            buffer = fh.read(blocksize * buffer_blocks)
-            for n in range(buffer_blocks):
-                print(n)
-                data = buffer[n * blocksize : min((n + 1) * blocksize, len(buffer))]
-                m.update(data)
-                if not data:
+            buffer = buffers[0]
+            while n:
+                update(buffer[:n])
+                n = fh.readinto(buffer)
+    return {algorithm: m.hexdigest() for algorithm, m in zip(algorithms, hashes)}
+
+
+def entry_signature(entry):
+    """(size, mtime_ns, inode) of an os.DirEntry, to detect changed files.
+
+    None if the file cannot be read, e.g. a broken symbolic link or a file
+    deleted since the listing: the error is logged.
+    """
+    try:
+        st = entry.stat()
+    except OSError as e:
+        log_message(f"Cannot read {entry.path}: {e}", logging.ERROR)
+        return None
+    return (st.st_size, st.st_mtime_ns, entry.inode())
+
+
+class ChecksumCache:
+    """Checksums of previous runs, stored in a SQLite file.
+
+    Files are keyed by their path relative to the ingestion folder and
+    archive members by their archive's path and member name; checksums are
+    only returned while the (size, mtime_ns, inode) signature of the file,
+    or of the archive, is unchanged. Checksums are {algorithm: digest}
+    dicts, stored as JSON. Only used from the main thread.
+    """
+
+    commit_interval = 1000
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER,
+                inode INTEGER, digests TEXT
+            );
+            CREATE TABLE IF NOT EXISTS members (
+                archive TEXT, member TEXT, size INTEGER, mtime_ns INTEGER,
+                inode INTEGER, digests TEXT, PRIMARY KEY (archive, member)
+            );
+            """
+        )
+        self.pending_writes = 0
+
+    def lookup(self, path, signature):
+        row = self.connection.execute(
+            "SELECT digests FROM files "
+            "WHERE path=? AND size=? AND mtime_ns=? AND inode=?",
+            (path, *signature),
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def store(self, path, signature, digests):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+            (path, *signature, json.dumps(digests)),
+        )
+        self.wrote(1)
+
+    def lookup_archive(self, archive, signature, members):
+        """(member, digests) list of members, or None unless all of them are cached."""
+        md5list = []
+        for member in members:
+            row = self.connection.execute(
+                "SELECT digests FROM members WHERE archive=? AND member=? "
+                "AND size=? AND mtime_ns=? AND inode=?",
+                (archive, member, *signature),
+            ).fetchone()
+            if row is None:
+                return None
+            md5list.append((member, json.loads(row[0])))
+        return md5list
+
+    def store_archive(self, archive, signature, md5list):
+        # members of a previous version of the archive are obsolete
+        self.connection.execute(
+            "DELETE FROM members WHERE archive=? "
+            "AND NOT (size=? AND mtime_ns=? AND inode=?)",
+            (archive, *signature),
+        )
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (archive, member, *signature, json.dumps(digests))
+                for member, digests in md5list
+            ],
+        )
+        self.wrote(len(md5list))
+
+    def wrote(self, n):
+        # commit regularly, so that an interrupted run still feeds the cache
+        self.pending_writes += n
+        if self.pending_writes >= self.commit_interval:
+            self.connection.commit()
+            self.pending_writes = 0
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+class RunJournal:
+    """Checkpoint journal of the manifest being written, for resumable runs.
+
+    Each checksum is recorded as a JSON line as soon as it is known, with the
+    signature of its file (or archive). The journal is deleted when the run
+    completes; if the run is interrupted, a resumed run loads it and only
+    hashes what is missing or has changed. Same interface as ChecksumCache.
+    """
+
+    flush_interval = 2.0
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.files = {}
+        self.archives = {}
+        if resume and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as fh:
+                for line in fh:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # last line of an interrupted run
+                        continue
+                    signature = tuple(record["signature"])
+                    if "archive" in record:
+                        members = self.archives.setdefault(record["archive"], {})
+                        for member, digests in record["members"]:
+                            members[member] = (signature, digests)
+                    else:
+                        self.files[record["path"]] = (signature, record["digests"])
+        # everything is recorded again as the run goes: the new journal
+        # is complete even if this run is interrupted too
+        self.fh = open(path, "w", encoding="utf-8")
+        self.last_flush = time.monotonic()
+
+    def lookup(self, path, signature):
+        signature_digests = self.files.get(path)
+        if signature_digests is None or signature_digests[0] != signature:
+            return None
+        return signature_digests[1]
+
+    def store(self, path, signature, digests):
+        self.write({"path": path, "signature": signature, "digests": digests})
+
+    def lookup_archive(self, archive, signature, members):
+        archived = self.archives.get(archive, {})
+        md5list = []
+        for member in members:
+            signature_digests = archived.get(member)
+            if signature_digests is None or signature_digests[0] != signature:
+                return None
+            md5list.append((member, signature_digests[1]))
+        return md5list
+
+    def store_archive(self, archive, signature, md5list):
+        self.write({"archive": archive, "signature": signature, "members": md5list})
+
+    def write(self, record):
+        self.fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            self.fh.flush()
+            self.last_flush = time.monotonic()
+
+    def close(self):
+        self.fh.close()
+
+    def remove(self):
+        self.close()
+        os.remove(self.path)
+
+
+class ChecksumStores:
+    """Chain of checksum stores (run journal, cache): lookups return the
+    first hit with a digest for each of the algorithms, results are stored
+    in all of them. Cached results, found by a lookup, are only stored in
+    the first one, the run journal, which records everything the run does:
+    the cache is not written again for unchanged files."""
+
+    def __init__(self, stores, algorithms=("md5",)):
+        self.stores = stores
+        self.algorithms = algorithms
+
+    def complete(self, digests):
+        return all(algorithm in digests for algorithm in self.algorithms)
+
+    def lookup(self, path, signature):
+        for store in self.stores:
+            digests = store.lookup(path, signature)
+            if digests is not None and self.complete(digests):
+                return digests
+        return None
+
+    def store(self, path, signature, digests, cached=False):
+        for store in self.stores[:1] if cached else self.stores:
+            store.store(path, signature, digests)
+
+    def lookup_archive(self, archive, signature, members):
+        for store in self.stores:
+            md5list = store.lookup_archive(archive, signature, members)
+            if md5list is not None and all(
+                self.complete(digests) for _, digests in md5list
+            ):
+                return md5list
+        return None
+
+    def store_archive(self, archive, signature, md5list, cached=False):
+        for store in self.stores[:1] if cached else self.stores:
+            store.store_archive(archive, signature, md5list)
+
+
+def cached_md5(cache, signatures, filename):
+    return cache.lookup(filename, signatures[filename])
+
+
+def cached_archive_md5list(cache, sessions, choosedir, task):
+    archivename, extension, members = task
+    archive = "." + archivename[len(choosedir) :]
+    session = sessions[archivename]
+    return cache.lookup_archive(archive, session.signature, session.expand(members))
+
+
+class ExclusionFilter:
+    """Files and folders left out of the listing, as one compiled regex.
+
+    excluded_names are paths relative to the ingestion folder (tool output
+    files), excluded along with anything whose path starts with them.
+    patterns are glob patterns (fnmatch syntax): without "/", they match the
+    name of a file or folder anywhere, e.g. "*.tmp" or "@eaDir"; with "/",
+    its path relative to the ingestion folder, e.g. "raw/*.log".
+    default_excluded_names are always excluded.
+    """
+
+    def __init__(self, excluded_names=(), patterns=()):
+        names = list(default_excluded_names)
+        paths = []
+        for pattern in patterns:
+            (paths if "/" in pattern else names).append(pattern.lstrip("/"))
+        # fnmatch.translate() anchors the end of each pattern; its "*" also
+        # matches "/", so name patterns only see the last path component
+        self.name_regex = re.compile("|".join(fnmatch.translate(n) for n in names))
+        rules = []
+        if paths:
+            rules.append("^(?:%s)" % "|".join(fnmatch.translate(p) for p in paths))
+        if excluded_names:
+            prefixes = [re.escape(n.replace(os.sep, "/")) for n in excluded_names]
+            rules.append("^(?:%s)" % "|".join(prefixes))
+        self.path_regex = re.compile("|".join(rules)) if rules else None
+
+    def excludes(self, path):
+        """True if path, relative to the ingestion folder with "/"
+        separators, is left out."""
+        if self.name_regex.match(posixpath.basename(path)):
+            return True
+        return self.path_regex is not None and self.path_regex.match(path) is not None
+
+
+def scan_folder(choosedir, archiver_list, exclusions=None):
+    """List choosedir in a single os.scandir() pass.
+
+    Returns (loose_files, archives, multipart_names): the os.DirEntry of
+    every file that is not an archive, a dict mapping each extension of
+    archiver_list to the DirEntry of its archives, and the names matching
+    multipart_hint_extensions. Folders are visited depth-first, each folder's
+    files before its sub-folders; symbolic links to folders are skipped.
+    DirEntry caches its file type (and stat() result), so no path is stat'ed
+    twice. Files and folders excluded by the ExclusionFilter exclusions are
+    skipped, and such folders are not even listed.
+    """
+    if exclusions is None:
+        exclusions = ExclusionFilter()
+    loose_files = []
+    archives = {extension: [] for extension in archiver_list}
+    multipart_names = []
+    archive_suffixes = tuple(archiver_list)
+    # (folder, its path relative to choosedir with "/" separators)
+    stack = [(choosedir, "")]
+    exclusion_time = 0.0
+    while stack:
+        (folder, relative) = stack.pop()
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError as e:
+            log_message(f"Cannot list {folder}: {e}")
+            continue
+        start = time.perf_counter()
+        entries = [e for e in entries if not exclusions.excludes(relative + e.name)]
+        exclusion_time += time.perf_counter() - start
+        subfolders = []
+        for entry in entries:
+            if entry.name.endswith(multipart_hint_extensions):
+                multipart_names.append(entry.name)
+            if entry.is_dir(follow_symlinks=False):
+                subfolders.append((entry.path, relative + entry.name + "/"))
+            elif entry.is_dir():
+                # symbolic link to a folder
+                continue
+            elif archive_suffixes and entry.name.endswith(archive_suffixes):
+                for extension in archiver_list:
+                    if entry.name.endswith(extension):
+                        archives[extension].append(entry)
+            else:
+                loose_files.append(entry)
+        stack.extend(reversed(subfolders))
+    run_metrics.add_phase("exclusion", exclusion_time)
+    return (loose_files, archives, multipart_names)
+
+
+def md5_file(filename, algorithms=("md5",)):
+    """{algorithm: digest} dict of a file, MD5 only by default."""
+    with open(filename, "rb") as fh:
+        return checksums(fh, algorithms)
+
+
+def lpt_order(items, size):
+    """items, largest size(item) first.
+
+    Handing tasks out in this order to whichever worker is free (longest
+    processing time first) keeps all workers busy until close to the end:
+    a huge file is not left for last, while the others sit idle.
+    """
+    return sorted(items, key=size, reverse=True)
+
+
+def completion_map(jobs, idle=None):
+    """Run (executor, function, items, window, lookup) jobs at the same time.
+
+    Each job submits function(item) for its items in order, keeping at most
+    window tasks in flight. Yields (job index, item, future) triples as
+    futures complete, from every job. If lookup(item) returns a value other
+    than None, that value is the result and nothing is submitted for item.
+    idle() is called every progress_interval while no future completes.
+    """
+    iterators = [iter(items) for (_, _, items, _, _) in jobs]
+    in_flight = [0] * len(jobs)
+    pending = {}
+    while True:
+        for index, (executor, function, _, window, lookup) in enumerate(jobs):
+            while in_flight[index] < window:
+                item = next(iterators[index], pending)
+                if item is pending:
                     break
-            if not buffer:
-                break
-    return m.hexdigest()
+                value = None if lookup is None else lookup(item)
+                if value is None:
+                    future = executor.submit(function, item)
+                else:
+                    future = concurrent.futures.Future()
+                    future.set_result(value)
+                pending[future] = (index, item)
+                in_flight[index] += 1
+        if not pending:
+            return
+        done, _ = concurrent.futures.wait(
+            pending,
+            timeout=None if idle is None else progress_interval,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        if not done:
+            idle()
+        # in submission order: a failure does not skip results done before it
+        for future in [f for f in pending if f in done]:
+            index, item = pending.pop(future)
+            in_flight[index] -= 1
+            yield index, item, future
+
+
+def archive_tasks(archive_content, archiver_list, chunk_members):
+    """Split the archives to hash into (archivename, extension, members) tasks.
+
+    Zip members can be read independently of each other, so big zips are
+    split into consecutive ranges of chunk_members members. Other formats
+    are decompressed sequentially and make one task per archive.
+    """
+    for extension in archiver_list:
+        for session in archive_content[extension]:
+            archivename, members = session.archivename, session.members
+            if extension == ".zip" and len(members) > chunk_members:
+                for start in range(0, len(members), chunk_members):
+                    yield (archivename, extension, members[start : start + chunk_members])
+            else:
+                yield (archivename, extension, members)
+
 
+def hash_archive_task(task, algorithms=("md5",), nested_depth=0):
+    """Process pool worker: reopen an archive and hash some of its members.
 
-def refresh_tk_component(tk_component):
-    # Not called as I'd like
-    tk_component.update()
-    print("timer ticked")
-    threading.Timer(5, refresh_tk_component, [tk_component]).start()
+    Returns the (member, {algorithm: digest}) list of the task's members,
+    nested archives among them expanded down to nested_depth levels.
+    """
+    archivename, extension, filelist = task
+    (archivename, archive) = open_archive(archivename, extension)
+    if archive is None:
+        # open_archive() has already logged the error
+        return []
+    try:
+        sink = NullProgress()
+        md5list, _ = handleArchive(
+            filelist,
+            archive,
+            len(filelist),
+            0,
+            1,
+            sink,
+            sink,
+            algorithms=algorithms,
+            depth=nested_depth,
+        )
+    finally:
+        archive.close()
+    return md5list
+
+
+def write_digest_line(outputs, path, digests):
+    """Write a manifest line to each output, with the digest of its algorithm."""
+    for algorithm, f in outputs.items():
+        f.write(f"{digests[algorithm]} {path}\n".encode("UTF-8"))
+
+
+def write_archive_md5list(outputs, choosedir, myarchfile, md5list):
+    """Write the manifest lines of archive members, relative to the archive folder."""
+    archive_path = os.path.sep.join(myarchfile.split(os.sep)[0:-1])
+    archive_path = archive_path.replace(choosedir, ".")
+    for archived_file, digests in md5list:
+        # Filenames of objects inside a zip are either:
+        # 1) cp850/cp437 (old style)
+        # 2) utf-8. Let's check
+        assumed_encoding = "cp850" if is_cp850(archived_file) else "utf-8"
+
+        # In order to match what Libsafe sees on the filesystem:
+        # - filenames must be encoded as UTF-8
+        # - NFC normalization is not needed: the Libsafe Archive Extractor will manage
+        path = archive_path + os.path.sep + archived_file.encode(assumed_encoding).decode("utf-8")
+        write_digest_line(outputs, path.replace("/", backslash), digests)
+
+
+class VerificationFailed(Exception):
+    """Raised by ManifestVerifier in fail-fast mode, on the first failure."""
+
+
+def parse_manifest_line(line):
+    """(md5, path) of a manifest line, as bytes; path is NFC-normalized."""
+    md5, _, path = line.decode("UTF-8").rstrip("\r\n").partition(" ")
+    return (md5.lower(), normalize("NFC", path))
+
+
+def manifest_sort_key(line):
+    """Manifest lines are sorted by path (UTF-8 bytes), then by digest."""
+    digest, _, path = line.partition(b" ")
+    return (path, digest)
+
+
+class SortedManifest:
+    """Manifest file written in path order, whatever the order of the lines.
+
+    Takes the place of the manifest file opened in binary mode: write()
+    receives the lines as results arrive. They are kept in memory by runs of
+    at most run_lines, each sorted and spilled to a temporary file when full,
+    and close() merges the runs into path. Memory does not grow with the
+    dataset, and the manifest is the same from run to run and machine to
+    machine, whatever the order of the listing and of the workers.
+    The runs are merged into path + ".tmp", which then replaces path: a
+    failed run calls discard() instead, and never leaves a manifest that
+    looks complete.
+    """
+
+    def __init__(self, path, run_lines=None):
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.run_lines = run_lines or manifest_run_lines
+        self.lines = []
+        self.runs = []
+        # fail now, as open() would, if the manifest cannot be written
+        open(self.temp_path, "wb").close()
+
+    def write(self, data):
+        self.lines.extend(data.splitlines(keepends=True))
+        if len(self.lines) >= self.run_lines:
+            self.spill()
+        return len(data)
+
+    def spill(self):
+        with run_metrics.phase("manifest write"):
+            self.lines.sort(key=manifest_sort_key)
+            run = tempfile.TemporaryFile()
+            run.writelines(self.lines)
+            run.seek(0)
+        self.runs.append(run)
+        self.lines = []
+
+    def close(self):
+        if self.lines is None:
+            return
+        try:
+            with run_metrics.phase("manifest write"):
+                with open(self.temp_path, "wb") as fh:
+                    self.lines.sort(key=manifest_sort_key)
+                    fh.writelines(
+                        heapq.merge(*self.runs, self.lines, key=manifest_sort_key)
+                    )
+                os.replace(self.temp_path, self.path)
+        finally:
+            self.discard()
+
+    def discard(self):
+        """Drop the lines written so far: path is left as it was."""
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        self.lines = None
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.temp_path)
+
+
+class ManifestVerifier:
+    """Compares manifest lines with an existing manifest file.
+
+    Takes the place of the manifest file in the hashing phase: write()
+    receives the lines that would be written, in the same format, and
+    matches them with the manifest's. A path may be listed more than once
+    (e.g. the same name in two archives of a folder): lines are matched as
+    a multiset of (path, md5) pairs. finish() sorts the lines left on each
+    side out into mismatched, missing and extra paths.
+    """
+
+    def __init__(self, manifest_path, fail_fast=False):
+        self.fail_fast = fail_fast
+        self.expected = collections.Counter()
+        with open(manifest_path, "rb") as fh:
+            for line in fh:
+                if line.strip():
+                    md5, path = parse_manifest_line(line)
+                    self.expected[(path, md5)] += 1
+        self.paths = {path for path, _ in self.expected}
+        # paths of the lines written that are not in the manifest
+        self.unexpected = []
+        self.mismatched = []
+        self.missing = []
+        self.extra = []
+
+    def write(self, data):
+        for line in data.splitlines():
+            md5, path = parse_manifest_line(line)
+            if self.expected[(path, md5)] > 0:
+                self.expected[(path, md5)] -= 1
+            elif self.fail_fast:
+                (self.mismatched if path in self.paths else self.extra).append(path)
+                raise VerificationFailed(path)
+            else:
+                self.unexpected.append(path)
+        return len(data)
+
+    def finish(self):
+        left = collections.Counter(path for path, _ in self.expected.elements())
+        for path in self.unexpected:
+            if left[path] > 0:
+                left[path] -= 1
+                self.mismatched.append(path)
+            else:
+                self.extra.append(path)
+        self.missing = list(left.elements())
+
+    def ok(self):
+        return not (self.mismatched or self.missing or self.extra)
+
+
+def timed(function, item):
+    """(function(item), seconds it took): for RunMetrics, from pool workers."""
+    start = time.perf_counter()
+    result = function(item)
+    return (result, time.perf_counter() - start)
+
+
+def write_file_result(outputs, choosedir, signatures, stores, element, future):
+    """Store and write the checksums of a loose file, or log why it failed.
+
+    future gives (digests, seconds spent hashing, or None if cached); returns
+    the seconds, None on failure.
+    """
+    debug("processing %s", element)
+    try:
+        (digests, seconds) = future.result()
+    except Exception as e:
+        trace = traceback.format_exc()
+        log_message(str(trace), logging.ERROR)
+        return None
+    stores.store(element, signatures[element], digests, cached=seconds is None)
+    # In order to match what Libsafe sees on the filesystem:
+    # - filenames must be encoded as UTF-8
+    # - NFC normalization for representation of accented characters
+    path = element.replace(choosedir, ".").replace("/", backslash)
+    write_digest_line(outputs, normalize("NFC", path), digests)
+    return seconds
+
+
+def write_archive_result(outputs, choosedir, sessions, stores, task, future):
+    """Store and write the checksums of an archive task, or log why it failed.
+
+    Same future result and return value as write_file_result().
+    """
+    (myarchfile, extension, filelist) = task
+    seconds = None
+    try:
+        (md5list, seconds) = future.result()
+        stores.store_archive(
+            "." + myarchfile[len(choosedir) :],
+            sessions[myarchfile].signature,
+            md5list,
+            cached=seconds is None,
+        )
+    except Exception as e:
+        trace = traceback.format_exc()
+        log_message(str(trace), logging.ERROR)
+        md5list = []
+    write_archive_md5list(outputs, choosedir, myarchfile, md5list)
+    return seconds
+
+
+def hash_dataset(
+    outputs,
+    choosedir,
+    files,
+    archive_content,
+    archiver_list,
+    signatures,
+    stores,
+    algorithms,
+    workers,
+    archive_processes,
+    progress,
+    reporter,
+    nested_depth=0,
+):
+    """Write the manifest lines of loose files and archive members.
+
+    outputs maps each of the hashlib algorithms to its manifest, a
+    SortedManifest, or anything with a compatible write() method such as a
+    ManifestVerifier. Each file is read once for all algorithms.
+    Loose files are hashed by a pool of threads (I/O-bound), and
+    with archive_processes > 0, archives by a pool of processes at the same
+    time (CPU-bound); both pools get the largest work first, and results are
+    written as they complete: SortedManifest puts the lines in order.
+    Otherwise, archives are hashed in this process once the files are done.
+    Archives nested in archives are expanded down to nested_depth levels.
+    progress counts the files done before, reported to the ProgressReporter.
+    """
+    sessions = {
+        session.archivename: session
+        for sessions in archive_content.values()
+        for session in sessions
+    }
+
+    def task_size(task):
+        sizes = sessions[task[0]].member_sizes
+        return sum(sizes.get(member, 0) for member in task[2])
+
+    def cached_file(element):
+        # the other files count their bytes as they are hashed
+        digests = cached_md5(stores, signatures, element)
+        if digests is None:
+            return None
+        reporter.count_bytes(signatures[element][0])
+        return (digests, None)
+
+    def cached_task(task):
+        md5list = cached_archive_md5list(stores, sessions, choosedir, task)
+        return None if md5list is None else (md5list, None)
+
+    set_byte_callback(reporter.count_bytes)
+    with contextlib.ExitStack() as pools:
+        pools.callback(set_byte_callback, None)
+        io_pool = pools.enter_context(
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers))
+        )
+        jobs = [
+            (
+                io_pool,
+                partial(timed, partial(md5_file, algorithms=algorithms)),
+                lpt_order(files, lambda element: signatures[element][0]),
+                4 * max(1, workers),
+                cached_file,
+            )
+        ]
+        if archive_processes > 0:
+            cpu_pool = pools.enter_context(
+                concurrent.futures.ProcessPoolExecutor(
+                    max_workers=archive_processes,
+                    initializer=init_archive_worker,
+                    initargs=(read_ahead_depth, verbosity),
+                )
+            )
+            tasks = archive_tasks(archive_content, archiver_list, archive_chunk_members)
+            jobs.append(
+                (
+                    cpu_pool,
+                    partial(
+                        timed,
+                        partial(
+                            hash_archive_task,
+                            algorithms=algorithms,
+                            nested_depth=nested_depth,
+                        ),
+                    ),
+                    lpt_order(tasks, task_size),
+                    2 * archive_processes,
+                    cached_task,
+                )
+            )
+        span = "loose files" if archive_processes == 0 else "files and archives"
+        bytes_before = reporter.bytes
+        with trace_span(span):
+            # results are consumed from this thread only: progress is never
+            # reported from a hashing thread
+            for job, item, future in completion_map(jobs, idle=reporter.refresh):
+                if job == 0:
+                    seconds = write_file_result(
+                        outputs, choosedir, signatures, stores, item, future
+                    )
+                    if seconds is not None:
+                        run_metrics.add_work(
+                            "loose hashing", "file", item, seconds, signatures[item][0]
+                        )
+                    progress += 1
+                    reporter.advance(progress)
+                else:
+                    seconds = write_archive_result(
+                        outputs, choosedir, sessions, stores, item, future
+                    )
+                    if seconds is not None:
+                        run_metrics.add_work(
+                            f"archive hashing {item[1]}",
+                            "archive",
+                            "." + item[0][len(choosedir) :],
+                            seconds,
+                            task_size(item),
+                        )
+                    # hashed in another process: counted when done
+                    progress += len(sessions[item[0]].expand(item[2]))
+                    reporter.advance(progress, task_size(item))
+        # bytes hashed in the phase, for its MB/s: trace_span() timed it
+        run_metrics.add_phase(span, 0, reporter.bytes - bytes_before)
+        if archive_processes == 0:
+            # the thread pool is idle by now
+            bytes_before = reporter.bytes
+            with trace_span("archives"):
+                progress = hash_archives(
+                    outputs,
+                    choosedir,
+                    archive_content,
+                    archiver_list,
+                    stores,
+                    algorithms,
+                    progress,
+                    reporter,
+                )
+            run_metrics.add_phase("archives", 0, reporter.bytes - bytes_before)
+    return progress
+
+
+def hash_archives(
+    outputs,
+    choosedir,
+    archive_content,
+    archiver_list,
+    stores,
+    algorithms,
+    progress,
+    reporter,
+):
+    """Write the manifest lines of archive members, hashed in this process."""
+    for extension in archiver_list:
+        for session in archive_content[extension]:
+            if not session.valid:
+                # open_archive() has already logged the error
+                continue
+            archive = "." + session.archivename[len(choosedir) :]
+            md5list = stores.lookup_archive(archive, session.signature, session.leaves)
+            if md5list is not None:
+                session.close()
+                stores.store_archive(archive, session.signature, md5list, cached=True)
+                progress += len(md5list)
+                reporter.advance(progress, session.size)
+                write_archive_md5list(outputs, choosedir, session.archivename, md5list)
+                continue
+            try:
+                start = time.perf_counter()
+                # the reporter throttles handleArchive's per-member updates
+                with trace_span(session.archivename, logging.DEBUG):
+                    md5list, progress = handleArchive(
+                        session.members,
+                        session.open(),
+                        reporter.total_files,
+                        progress,
+                        1,
+                        reporter,
+                        reporter,
+                        algorithms=algorithms,
+                        depth=session.nested_depth,
+                    )
+                run_metrics.add_work(
+                    f"archive hashing {extension}",
+                    "archive",
+                    archive,
+                    time.perf_counter() - start,
+                    session.size,
+                )
+                # the bytes were counted as they were hashed
+                reporter.advance(progress)
+                stores.store_archive(archive, session.signature, md5list)
+            except Exception as e:
+                trace = traceback.format_exc()
+                log_message(str(trace), logging.ERROR)
+                md5list = []
+            finally:
+                session.close()
+            write_archive_md5list(outputs, choosedir, session.archivename, md5list)
+    return progress
+
+
+def poll_checksum_events(tkroot, events, progress_info, error_message):
+    """Tk main loop side of a GUI run: show what the checksum thread posted."""
+    while True:
+        try:
+            kind, value = events.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "progress":
+            progress_info.config(text=value)
+        elif kind == "done":
+            if value:
+                error_info = tk.Label(tkroot, text=error_message)
+                error_info.pack()
+            done_info = tk.Label(tkroot, text="Done: ACOUA_md5.md5 has been created")
+            done_info.pack()
+            return
+        else:
+            failed_info = tk.Label(tkroot, text=f"Failed: {value}")
+            failed_info.pack()
+            return
+    tkroot.after(
+        gui_poll_interval,
+        poll_checksum_events,
+        tkroot,
+        events,
+        progress_info,
+        error_message,
+    )
 
 
 def runchecksum(tkroot, width_chars, check_zips):
+    global gui_worker
+    if gui_worker is not None and gui_worker.is_alive():
+        # one folder at a time
+        return
+
     # Clear all existing text messages
     do_zips = bool(check_zips.get())
 
     if do_zips:
         archiver_list = listbox.get(0, tk.END)
+        if len(archiver_list) == 0:
+            archiver_list = [".zip"]
     else:
         archiver_list = []
-    if len(archiver_list) == 0:
-        archiver_list = [".zip"]
-    print("archiver list", archiver_list)
+    debug("archiver list %s", archiver_list)
 
     for label in tkroot.winfo_children():
         if type(label) is tk.Label:
@@ -337,29 +2317,15 @@ def runchecksum(tkroot, width_chars, check_zips):
 
     error_message = f"There were errors or warnings during processing:\n"
     error_message += f"check {error_file} for information."
-    error_file_header = f"This is the acouachecksum {version} log for errors and warnings. Do not archive.\n"
 
     d_title = "Select your ingestion folder"
     choosedir = filedialog.askdirectory(initialdir=Path.home(), title=d_title)
     if choosedir == "" or not os.path.exists(choosedir):
         return
-    os.chdir(choosedir)
-
-    # delete existing logfile unless it doesn't exist
-    try:
-        os.remove(error_file)
-    except OSError:
-        pass
-
-    # Normalize base folder to the OS's convention
-    # (disregard askdirectory()'s weirdness)
-    choosedir = os.getcwd()
-    # get folder name, useful to check for path length
-    foldername = choosedir.split(os.sep)[-1]
 
     choosedir_display = ""
     line_length = 0
-    for fs_level in choosedir.split(os.sep):
+    for fs_level in os.path.normpath(choosedir).split(os.sep):
         if len(fs_level) > width_chars:
             fs_level = fs_level[0 : width_chars - 6] + "[...]"
 
@@ -375,246 +2341,706 @@ def runchecksum(tkroot, width_chars, check_zips):
     path_info.pack()
     tkroot.update()
 
+    # Create tk.Tk label for progress information
+    progress_info = tk.Label(tkroot, text="Listing: 0 files")
+    progress_info.pack()
+    tkroot.update()
+
+    # The checksum runs on a worker thread, so that the window stays
+    # responsive: progress comes back through a queue, polled with after()
+    events = queue.Queue()
+    sink = QueuedProgress(events)
+
+    def work():
+        try:
+            has_errors = checksum_folder(choosedir, archiver_list, sink, sink)
+        except Exception as e:
+            traceback.print_exc()
+            events.put(("failed", e))
+        else:
+            events.put(("done", has_errors))
+
+    gui_worker = threading.Thread(target=work, daemon=True)
+    gui_worker.start()
+    poll_checksum_events(tkroot, events, progress_info, error_message)
+
+
+def start_run(choosedir):
+    """Move to choosedir and start a new error log; returns its normalized path."""
+    os.chdir(choosedir)
+
+    # delete existing logfile unless it doesn't exist
+    try:
+        os.remove(error_file)
+    except OSError:
+        pass
+
     # Create logfile for potential warnings and errors
-    log_message(error_file_header)
+    with open(error_file, "w") as f_err:
+        f_err.write(f"{error_file_header}\n")
+    start_error_log(error_file)
+    run_metrics.reset()
 
-    all_files = list(pathlib.Path(choosedir).rglob("**/*"))
-    for hint in multipart_hint_extensions:
-        for file in all_files:
-            if file.name.endswith(hint):
-                log_message(f" Is {file.name} part of a multipart archive?")
-                log_message("=> this is not supported and will probably fail.")
+    # Normalize base folder to the OS's convention
+    # (disregard askdirectory()'s weirdness)
+    return os.getcwd()
 
-    # TODO compressed formats are not processed simultaneously, needsto adapt
-    #
-    arch_files = []
-    if do_zips:
-        for idx, extension in enumerate(archiver_list):
-            if idx == 0 or (extension not in archiver_list[0 : idx - 1]):
-                arch_files.append(
-                    list(pathlib.Path(choosedir).rglob(f"**/*{extension}"))
-                )
 
-        nonzipfiles = [
-            x
-            for x in all_files
-            if not any([x.name.endswith(ext) for ext in archiver_list])
-        ]
+def finish_run():
+    """Remove the error log if nothing was logged; returns True otherwise."""
+    stop_error_log()
+    with open(error_file, "r") as f_err:
+        error_content = f_err.read()
+
+    if re.sub("[\r\n]", "", error_content) == re.sub("[\r\n]", "", error_file_header):
+        os.remove(error_file)
+        return False
+    return True
 
-    else:
-        nonzipfiles = all_files
-        arch_backlog = {}
-        for extension in compressed_extensions:
-            arch_files.append((extension, []))
-            arch_backlog[extension] = []
 
-    print("arch:", arch_files)
-    print("non arch", nonzipfiles)
+def list_dataset(
+    choosedir,
+    archiver_list,
+    excluded_names,
+    archive_processes,
+    reporter,
+    nested_depth=0,
+    exclude_patterns=(),
+):
+    """Listing phase: find the files and archive members to checksum.
+
+    Logs path length warnings, multipart archives and name collisions, and
+    reports the number of files found to the ProgressReporter.
+    excluded_names are paths relative to choosedir (tool output files) that
+    are left out, along with anything whose path starts with them, and
+    exclude_patterns glob patterns of files and folders left out (see
+    ExclusionFilter).
+    Returns (files, signatures, archive_content, total_files): the relative
+    paths of loose files, the signature of every file and archive, and for
+    each extension of archiver_list its ArchiveSession list. Archives nested
+    in archives are expanded down to nested_depth levels.
+    """
+    # get folder name, useful to check for path length
+    foldername = choosedir.split(os.sep)[-1]
+    # (size, mtime_ns, inode) of files and archives, for the journal and cache
+    signatures = {}
+
+    exclusions = ExclusionFilter(excluded_names, exclude_patterns)
+    with run_metrics.phase("walk"):
+        loose_files, arch_files, multipart_names = scan_folder(
+            choosedir, archiver_list, exclusions
+        )
+    for hint in multipart_hint_extensions:
+        for name in multipart_names:
+            if name.endswith(hint):
+                log_message(f" Is {name} part of a multipart archive?")
+                log_message("=> this is not supported and will probably fail.")
+
+    debug(
+        "listed %d loose files, archives: %s",
+        len(loose_files),
+        {ext: len(entries) for ext, entries in arch_files.items()},
+    )
 
     files = []
-    final_filelist = []
-    # Create tk.Tk label for progress information: counting files
-    progress_update_frequency = 10
-    progress_info = tk.Label(tkroot, text=f"Listing: {len(files)} files")
-    progress_info.pack()
-    tkroot.update()
-    # refresh_tk_component(tkroot)
-    for ls in nonzipfiles:
+    # full path + filename collisions result in data loss and/or ingestion errors
+    names = NameIndex()
+    # collisions are reported as they are found: only their time is summed
+    collision_time = 0.0
+    # progress information: counting files
+    reporter.start("Listing")
+    for ls in loose_files:
+        signature = entry_signature(ls)
+        if signature is None:
+            continue
         # check for excessive path length locally
         # (in case the user has a problem)
-        if len(os.path.join(str(ls.parents[0]), ls.name)) > MAX_PATH:
+        if len(ls.path) > MAX_PATH:
             log_message(f"WARNING > {MAX_PATH} chars for path + file name:")
-            log_message(f"-> {os.path.join(str(ls.parents[0]), ls.name)}")
-        filename = os.path.join(str(ls.parents[0]).replace(choosedir, "."), ls.name)
-        if (
-            not filename.endswith(os.sep + ".DS_Store")
-            and not filename.endswith(os.sep + "Thumbs.db")
-            and not filename.startswith(os.path.join(choosedir, out_file))
-            and not filename.startswith(os.path.join(".", out_file))
-            and not filename.startswith(os.path.join(choosedir, error_file))
-            and not filename.startswith(os.path.join(".", error_file))
-            and not os.path.isdir(filename)
-        ):
-            # check for excessive expected path length locally
-            # (where libsafe will fail)
-            target_path = libsafe_ingestion_path + foldername + filename[1:]
-            print("target_path", target_path.lower())
-            final_filelist.append(target_path.lower())
-            # print(target_path)
-            if len(target_path) > MAX_PATH:
-                log_message(f"WARNING > {MAX_PATH} chars for path + file name:")
-                log_message(f"-> {target_path}")
-            # filename = os.path.join([str(ls.parents[0]).replace(choosedir,'.'), ls.name])
-            if filename.startswith("/"):
-                files.append(filename[1:])
-            else:
-                files.append(filename)
-
-        if len(files) % progress_update_frequency == 0:
-            # print(f'Listing: {len(files)} files')
-            progress_info.config(text=f"Listing: {len(files)} files")
-            tkroot.update()
+            log_message(f"-> {ls.path}")
+        filename = "." + ls.path[len(choosedir) :]
+        # check for excessive expected path length locally
+        # (where libsafe will fail)
+        target_path = libsafe_ingestion_path + foldername + filename[1:]
+        debug("target_path %s", target_path)
+        start = time.perf_counter()
+        names.add(filename[2:].replace(os.sep, "/"))
+        collision_time += time.perf_counter() - start
+        if len(target_path) > MAX_PATH:
+            log_message(f"WARNING > {MAX_PATH} chars for path + file name:")
+            log_message(f"-> {target_path}")
+        # filename = os.path.join([str(ls.parents[0]).replace(choosedir,'.'), ls.name])
+        if filename.startswith("/"):
+            filename = filename[1:]
+        files.append(filename)
+        signatures[filename] = signature
 
-    # final_filelist += [f.lower() for f in files]
+        reporter.advance(len(files))
 
     archive_content = {}
     for extension in archiver_list:
-        archive_content[extension] = {}
+        archive_content[extension] = []
 
     n_archived_files = 0
-    # TODO adapt to process arch_content, then switch to subsequent formats in arch_backlog
-    for idx, extension in enumerate(archiver_list):
-        for ls in arch_files[idx]:
-            print(extension, ls)
+    n_open_archives = 0
+    for extension in archiver_list:
+        for ls in arch_files[extension]:
+            debug("listing %s", ls.path)
+            signature = entry_signature(ls)
+            if signature is None:
+                continue
             # Libsafe Sanitizers are run before the Archive Extractor
             # => .DS_Store and Thumbs.db will not be deleted if contained in an archive file
-            (archivename, archive) = open_archive(ls, extension)
-            archive_content[extension][archivename] = []
-            # TODO: implement behvior for content that would be extension[idx+1] in the sequence
-            # TODO: support other sub archives further down the sequence
-            for info in arch_content(archive):
-                print(arch_object_filename(info))
-                if idx <= len(archiver_list) - 2:
-                    if arch_object_filename(info).endswith(archiver_list[idx + 1]):
-                        print(f"Within {ls} : found {arch_object_filename(info)}")
-                        (subarchname, sub_arch) = open_archive(
-                            info, archiver_list[idx + 1], parent=archive
-                        )
-                        if sub_arch is not None:
-                            for x in arch_content(sub_arch):
-                                print("sub_arch contains:", x)
-                if not isdir(info):
-                    archive_content[extension][archivename].append(
-                        arch_object_filename(info)
-                    )
-
-            for content_file in archive_content[extension][archivename]:
+            with run_metrics.phase(f"archive listing {extension}"):
+                session = ArchiveSession(
+                    ls.path, extension, signature, nested_depth
+                )
+            archive_content[extension].append(session)
+            signatures[session.archivename] = session.signature
+            # members are extracted next to their archive
+            archive_folder = os.path.dirname(ls.path)[len(choosedir) + 1 :]
+            archive_folder = archive_folder.replace(os.sep, "/")
+            for content_file in session.leaves:
                 # check for likely excessive expected path length locally
                 # (where libsafe will fail)
                 target_path = libsafe_ingestion_path + foldername + "/" + content_file
-                print("target_path", target_path.lower())
-                final_filelist.append(target_path.lower())
+                debug("target_path %s", target_path)
+                start = time.perf_counter()
+                names.add(posixpath.join(archive_folder, content_file))
+                collision_time += time.perf_counter() - start
                 if len(target_path) > MAX_PATH:
                     log_message(f"WARNING > {MAX_PATH} chars for path + file name:")
                     log_message(f"-> {target_path}")
 
-            n_archived_files += len(archive_content[extension][archivename])
-            progress_msg = f"Listing: {len(files) + n_archived_files} files"
-            progress_info.config(text=progress_msg)
-            tkroot.update()
-    total_files = len(files) + n_archived_files
+            if archive_processes > 0 or n_open_archives >= max_open_archives:
+                # pool workers reopen archives themselves; otherwise, this
+                # avoids running out of file descriptors
+                session.close()
+            elif session.archive is not None:
+                n_open_archives += 1
 
-    # check for full path + filename collisions that will result in data loss and/or ingestion errors
-    # print(final_filelist)
-    name_collisions = [
-        (item, count)
-        for item, count in collections.Counter(final_filelist).items()
-        if count > 1
-    ]
-    for conflict in name_collisions:
-        log_message(
-            f"Name conflict: {conflict[0]} will occur {conflict[1]} times in your dataset (probably from several compressed files)."
-        )
+            n_archived_files += len(session.leaves)
+            reporter.advance(len(files) + n_archived_files)
+    run_metrics.add_phase("collision check", collision_time)
+    total_files = len(files) + n_archived_files
 
-    # print('Done listing')
-    # now display the actual checksum progress
-    progress_update_frequency = 1
-    progress = 0
-    progress_info.config(text=f"Checksum progress: {progress}/{total_files}")
-    tkroot.update()
+    return (files, signatures, archive_content, total_files)
+
+
+class NameIndex:
+    """Incremental detection of paths that Libsafe would see as the same.
+
+    Paths are compared relative to the ingestion folder, with "/" as the
+    separator, caseless and NFC-normalized, loose files and archive members
+    alike. Only an 8-byte digest of each path is kept, so memory does not
+    grow with path length.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.conflicts = 0
+
+    @staticmethod
+    def key(path):
+        path = path.replace(backslash, "/")
+        caseless = normalize("NFC", normalize("NFD", path).casefold())
+        digest = hashlib.blake2b(
+            caseless.encode("utf-8", "surrogatepass"), digest_size=8
+        ).digest()
+        return int.from_bytes(digest, "big")
+
+    def add(self, path):
+        """Record path, and log a conflict at once if it was seen before."""
+        key = self.key(path)
+        if key in self.seen:
+            self.conflicts += 1
+            log_message(
+                f"Name conflict: ./{path} occurs more than once in your dataset "
+                "(probably from several compressed files)."
+            )
+            return False
+        self.seen.add(key)
+        return True
 
-    f = open(out_file, "wb")
 
-    for element in files:
-        progress += 1
-        print("processing", element)
+def dataset_size(files, signatures, archive_content):
+    """Bytes to hash: loose files, and the uncompressed archive members."""
+    size = sum(signatures[filename][0] for filename in files)
+    for sessions in archive_content.values():
+        size += sum(session.size for session in sessions)
+    return size
+
+
+def sidecar_path(manifest_path, algorithm):
+    """The sidecar manifest of algorithm beside the MD5 manifest_path."""
+    return f"{os.path.splitext(manifest_path)[0]}.{algorithm}"
+
+
+def tool_file_names(choosedir, manifest_path, *paths):
+    """The files written by the tool, left out of the listing of choosedir.
+
+    Returns their paths relative to choosedir: the default output files,
+    manifest_path with its sidecar manifests (of any algorithm, so that
+    adding one to a re-run changes nothing) and its journal, whose name
+    starts with the manifest's, and the other paths given (None: unused).
+    The SQLite journal of the cache starts with the cache's name as well.
+    Paths outside choosedir, e.g. on another drive, cannot be listed.
+    """
+    outputs = []
+    for manifest in (os.path.join(choosedir, out_file), manifest_path):
+        outputs.append(manifest)
+        outputs += [sidecar_path(manifest, a) for a in sidecar_algorithms]
+    outputs += [path for path in paths if path is not None]
+    names = [out_file, error_file, metrics_file, cache_file]
+    for path in outputs:
         try:
-            fh = open(element, "rb")
-            md5 = md5Checksum2(fh)
-            # In order to match what Libsafe sees on the filesystem:
-            # - filenames must be encoded as UTF-8
-            # - NFC normalization for representation of accented characters
-            f.write(
-                normalize(
-                    "NFC",
-                    f'{md5} {element.replace(choosedir, ".").replace("/", backslash)}\n',
-                ).encode("UTF-8")
+            relative = os.path.relpath(path, choosedir)
+        except ValueError:
+            # Windows: on another drive
+            continue
+        if relative.split(os.path.sep)[0] != os.path.pardir:
+            names.append(relative)
+    return list(dict.fromkeys(names))
+
+
+def checksum_folder(
+    choosedir,
+    archiver_list,
+    progress_info,
+    tkroot,
+    out_path=None,
+    workers=default_hash_workers,
+    archive_processes=default_archive_processes,
+    cache_path=None,
+    resume=False,
+    extra_algorithms=(),
+    nested_depth=0,
+    exclude_patterns=(),
+    status_path=None,
+    metrics_path=None,
+):
+    """Write the ACOUA manifest for choosedir, without any user interaction.
+
+    archiver_list holds the archive extensions whose content is checksummed
+    instead of the archive itself (empty: archives are plain files).
+    progress_info and tkroot receive progress messages, at most once per
+    progress_interval: a QueuedProgress in the GUI, a ConsoleProgress in
+    headless mode.
+    workers is the number of threads hashing loose files concurrently,
+    archive_processes the number of processes hashing archive members
+    (0: archives are hashed in this process).
+    cache_path is the SQLite checksum cache to use (None: no cache): files
+    and archives unchanged since the cached run are not hashed again.
+    Completed checksums are journaled beside the manifest until the run
+    completes; with resume=True, the journal of an interrupted run is used
+    to only hash what is missing or has changed.
+    extra_algorithms are sidecar_algorithms computed in the same read pass
+    as MD5, each written to a sidecar manifest beside the MD5 one.
+    nested_depth is how many levels of archives inside archives are
+    expanded (0: a nested archive is checksummed as a file).
+    exclude_patterns are glob patterns of files and folders left out, beside
+    default_excluded_names and the tool's own files (see ExclusionFilter).
+    status_path is a JSON file where the progress is kept up to date, for
+    monitoring (None: no status file), see ProgressReporter.
+    metrics_path is where to write the RunMetrics report of the run as JSON
+    (None: no report).
+    Returns True if errors or warnings were written to the error file.
+    """
+    if out_path is None:
+        # default: the manifest goes inside the ingestion folder
+        out_path = os.path.join(os.path.abspath(choosedir), out_file)
+    else:
+        out_path = os.path.abspath(out_path)
+    if cache_path is not None:
+        cache_path = os.path.abspath(cache_path)
+    if status_path is not None:
+        status_path = os.path.abspath(status_path)
+    if metrics_path is not None:
+        metrics_path = os.path.abspath(metrics_path)
+    choosedir = start_run(choosedir)
+    reporter = ProgressReporter(progress_info, tkroot, status_path=status_path)
+
+    excluded_names = tool_file_names(
+        choosedir, out_path, cache_path, status_path, metrics_path
+    )
+    (cache, journal, outputs) = (None, None, {})
+    try:
+        if cache_path is not None:
+            cache = ChecksumCache(cache_path)
+
+        # the order of archiver_list is kept, but each format is processed once
+        archiver_list = list(dict.fromkeys(archiver_list))
+        with trace_span("listing"):
+            (files, signatures, archive_content, total_files) = list_dataset(
+                choosedir,
+                archiver_list,
+                excluded_names,
+                archive_processes,
+                reporter,
+                nested_depth,
+                exclude_patterns,
             )
-        except Exception as e:
-            trace = traceback.format_exc()
-            log_message(str(trace))
-        tk_progress_update(
-            total_files, progress, progress_update_frequency, progress_info, tkroot
-        )
-        """
-        if progress % progress_update_frequency == 0:
-            # print(f'Progress: {progress}/{len(files)}')
-            progress_info.config(text=f"Progress: {progress}/{total_files}")
-            tkroot.update()
-        """
-
-    for extension in archiver_list:
-        for myarchfile in archive_content[extension]:
-            (archivename, archive) = open_archive(myarchfile, extension)
-            archive_path = os.path.sep.join(myarchfile.split(os.sep)[0:-1])
-            print("archive_path = ", archive_path)
-            archive_path = archive_path.replace(choosedir, ".")
-            try:
-                md5list, progress = handleArchive(
-                    archive_content[extension][myarchfile],
-                    archive,
-                    total_files,
-                    progress,
-                    progress_update_frequency,
-                    progress_info,
-                    tkroot,
-                )
-            except Exception as e:
-                trace = traceback.format_exc()
-                log_message(str(trace))
-                md5list = []
 
-            for archived_file, md5 in md5list:
-                # Filenames of objects inside a zip are either:
-                # 1) cp850/cp437 (old style)
-                # 2) utf-8. Let's check
-                assumed_encoding = "cp850" if is_cp850(archived_file) else "utf-8"
-
-                # In order to match what Libsafe sees on the filesystem:
-                # - filenames must be encoded as UTF-8
-                # - NFC normalization is not needed: the Libsafe Archive Extractor will manage
-                f.write(
-                    f'{md5} {archive_path + os.path.sep + archived_file.encode(assumed_encoding).decode("utf-8")}\n'.replace(
-                        "/", backslash
-                    ).encode(
-                        "UTF-8"
-                    )
-                )
-                """
-                if progress % progress_update_frequency == 0:
-                    progress_msg = f"Progress: {progress}/{total_files}"
-                    progress_info.config(text=progress_msg)
-                    tkroot.update()
-                """
-
-    f.close()
-    progress_info.config(text=f"Progress: {progress}/{total_files}")
-    tkroot.update()
+        # now display the actual checksum progress
+        progress = 0
+        total_bytes = dataset_size(files, signatures, archive_content)
+        reporter.start("Checksum progress", total_files, total_bytes)
 
-    with open(error_file, "r") as f_err:
-        error_content = f_err.read()
+        journal = RunJournal(out_path + ".journal", resume=resume)
+        algorithms = ("md5",) + tuple(dict.fromkeys(extra_algorithms))
+        stores = ChecksumStores(
+            [journal] if cache is None else [journal, cache], algorithms
+        )
+        outputs["md5"] = SortedManifest(out_path)
+        for algorithm in algorithms[1:]:
+            outputs[algorithm] = SortedManifest(sidecar_path(out_path, algorithm))
+        progress = hash_dataset(
+            outputs,
+            choosedir,
+            files,
+            archive_content,
+            archiver_list,
+            signatures,
+            stores,
+            algorithms,
+            workers,
+            archive_processes,
+            progress,
+            reporter,
+            nested_depth,
+        )
+    except BaseException:
+        for f in outputs.values():
+            f.discard()
+        reporter.finish("failed")
+        raise
+    finally:
+        for f in outputs.values():
+            f.close()
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.close()
+        # an interrupted run still gets what was logged
+        stop_error_log()
+    journal.remove()
+
+    timings = reporter.finish()
+    reporter.config(f"Progress: {progress}/{total_files} ({timings})")
+    if metrics_path is not None:
+        run_metrics.write(metrics_path)
+
+    return finish_run()
+
+
+def verify_folder(
+    choosedir,
+    manifest_path,
+    archiver_list,
+    progress_info,
+    tkroot,
+    workers=default_hash_workers,
+    archive_processes=default_archive_processes,
+    fail_fast=False,
+    nested_depth=0,
+    exclude_patterns=(),
+    status_path=None,
+    metrics_path=None,
+):
+    """Check choosedir against an existing manifest, hashing everything again.
+
+    The folder is listed and hashed exactly as checksum_folder() would do,
+    but the resulting lines are compared with manifest_path instead of being
+    written. Problems are logged to the error file. With fail_fast, stops at
+    the first mismatching or unexpected file. nested_depth,
+    exclude_patterns, status_path and metrics_path are as for
+    checksum_folder().
+    Returns a ManifestVerifier holding the mismatched, missing and extra paths.
+    """
+    manifest_path = os.path.abspath(manifest_path)
+    if status_path is not None:
+        status_path = os.path.abspath(status_path)
+    if metrics_path is not None:
+        metrics_path = os.path.abspath(metrics_path)
+    verifier = ManifestVerifier(manifest_path, fail_fast=fail_fast)
+    choosedir = start_run(choosedir)
+    reporter = ProgressReporter(progress_info, tkroot, status_path=status_path)
+    excluded_names = tool_file_names(
+        choosedir, manifest_path, status_path, metrics_path
+    )
+
+    archiver_list = list(dict.fromkeys(archiver_list))
+    try:
+        with trace_span("listing"):
+            (files, signatures, archive_content, total_files) = list_dataset(
+                choosedir,
+                archiver_list,
+                excluded_names,
+                archive_processes,
+                reporter,
+                nested_depth,
+                exclude_patterns,
+            )
 
-    if re.sub("[\r\n]", "", error_content) == re.sub("[\r\n]", "", error_file_header):
-        os.remove(error_file)
+        progress = 0
+        total_bytes = dataset_size(files, signatures, archive_content)
+        reporter.start("Verification progress", total_files, total_bytes)
+
+        # nothing is looked up or stored: every byte is read again
+        algorithms = ("md5",)
+        stores = ChecksumStores([], algorithms)
+        outputs = {"md5": verifier}
+        progress = hash_dataset(
+            outputs,
+            choosedir,
+            files,
+            archive_content,
+            archiver_list,
+            signatures,
+            stores,
+            algorithms,
+            workers,
+            archive_processes,
+            progress,
+            reporter,
+            nested_depth,
+        )
+    except VerificationFailed:
+        pass
+    except BaseException:
+        reporter.finish("failed")
+        # an interrupted run still gets what was logged
+        stop_error_log()
+        raise
     else:
-        error_info = tk.Label(tkroot, text=error_message)
-        error_info.pack()
+        verifier.finish()
+    reporter.finish()
+    if metrics_path is not None:
+        run_metrics.write(metrics_path)
+
+    for path in verifier.mismatched:
+        log_message(f"Checksum mismatch: {path}", logging.ERROR)
+    for path in verifier.missing:
+        log_message(f"Missing from the folder: {path}", logging.ERROR)
+    for path in verifier.extra:
+        log_message(f"Not in the manifest: {path}", logging.ERROR)
+    finish_run()
+    return verifier
+
+
+def main_cli(argv=None):
+    """Headless entry point: python main.py --dir FOLDER [options]."""
+    parser = argparse.ArgumentParser(
+        description="Create the ACOUA_md5.md5 manifest of an ingestion folder."
+    )
+    parser.add_argument("--dir", required=True, help="ingestion folder to checksum")
+    parser.add_argument(
+        "--archives",
+        default=".zip",
+        help="comma-separated archive extensions whose content is checksummed, "
+        "e.g. .zip,.7z (empty string: checksum archives as plain files)",
+    )
+    parser.add_argument(
+        "--out", default=None, help=f"manifest path (default: DIR/{out_file})"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=default_hash_workers,
+        help=f"threads hashing files concurrently (default: {default_hash_workers})",
+    )
+    parser.add_argument(
+        "--archive-processes",
+        type=int,
+        default=default_archive_processes,
+        help="processes decompressing and hashing archives concurrently "
+        f"(default: {default_archive_processes}, i.e. in the main process)",
+    )
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const=True,
+        default=None,
+        help="reuse the checksums of unchanged files from a SQLite cache, "
+        f"updated by this run (default path: DIR/{cache_file})",
+    )
+    parser.add_argument(
+        "--verify",
+        nargs="?",
+        const=True,
+        default=None,
+        metavar="MANIFEST",
+        help="check the folder against an existing manifest instead of writing "
+        f"one (default: DIR/{out_file}); the exit status is 1 on any difference",
+    )
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="with --verify, stop at the first mismatching or unexpected file",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="resume an interrupted run: only hash what its journal is missing",
+    )
+    parser.add_argument(
+        "--read-ahead",
+        type=int,
+        default=read_ahead_depth,
+        help="blocks of a file read ahead while the previous ones are hashed "
+        f"(default: {read_ahead_depth}, 0 to disable)",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="count",
+        default=0,
+        help="trace on stderr: -v phases and their timings, -vv every file too",
+    )
+    parser.add_argument(
+        "--status",
+        default=None,
+        metavar="PATH",
+        help="keep a JSON status file (phase, files and bytes done, rate, ETA, "
+        "phase durations) up to date during the run, for monitoring",
+    )
+    parser.add_argument(
+        "--metrics",
+        nargs="?",
+        const=True,
+        default=None,
+        metavar="PATH",
+        help="write a JSON report of where the time went: phase timings, "
+        f"throughput, slowest files and archives, peak memory "
+        f"(default path: DIR/{metrics_file})",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="leave out files and folders matching this glob pattern, e.g. "
+        "'*.tmp' or '@eaDir' (a path relative to DIR if it contains /); "
+        "can be repeated",
+    )
+    parser.add_argument(
+        "--nested-depth",
+        type=int,
+        default=0,
+        help="levels of archives inside archives whose content is checksummed "
+        "too, without extracting them to disk (default: 0)",
+    )
+    parser.add_argument(
+        "--algorithms",
+        default="",
+        help="comma-separated checksums computed beside MD5 in the same pass, "
+        f"each in a sidecar manifest, e.g. sha256 (choose from "
+        f"{', '.join(sidecar_algorithms)})",
+    )
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.dir):
+        parser.error(f"{args.dir} is not a directory")
+    archiver_list = [ext.strip() for ext in args.archives.split(",") if ext.strip()]
+    for extension in archiver_list:
+        if extension not in compressed_extensions:
+            parser.error(
+                f"unsupported archive extension {extension} "
+                f"(choose from {', '.join(compressed_extensions)})"
+            )
 
-    done_info = tk.Label(tkroot, text="Done: ACOUA_md5.md5 has been created")
-    done_info.pack()
+    extra_algorithms = [a.strip() for a in args.algorithms.split(",") if a.strip()]
+    for algorithm in extra_algorithms:
+        if algorithm not in sidecar_algorithms:
+            parser.error(
+                f"unsupported algorithm {algorithm} "
+                f"(choose from {', '.join(sidecar_algorithms)})"
+            )
+    if extra_algorithms and args.verify is not None:
+        parser.error("--algorithms cannot be combined with --verify")
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.archive_processes < 0:
+        parser.error("--archive-processes cannot be negative")
+    if args.read_ahead < 0:
+        parser.error("--read-ahead cannot be negative")
+    if args.nested_depth < 0:
+        parser.error("--nested-depth cannot be negative")
+    set_read_ahead(args.read_ahead)
+    set_verbosity(args.verbose)
+    cache_path = args.cache
+    if cache_path is True:
+        cache_path = os.path.join(args.dir, cache_file)
+    metrics_path = args.metrics
+    if metrics_path is True:
+        metrics_path = os.path.join(args.dir, metrics_file)
+
+    sink = ConsoleProgress()
+    if args.verify is not None:
+        manifest_path = args.verify
+        if manifest_path is True:
+            manifest_path = os.path.join(args.dir, out_file)
+        if not os.path.isfile(manifest_path):
+            parser.error(f"{manifest_path} does not exist")
+        verifier = verify_folder(
+            args.dir,
+            manifest_path,
+            archiver_list,
+            sink,
+            sink,
+            workers=args.workers,
+            archive_processes=args.archive_processes,
+            fail_fast=args.fail_fast,
+            nested_depth=args.nested_depth,
+            exclude_patterns=args.exclude,
+            status_path=args.status,
+            metrics_path=metrics_path,
+        )
+        for label, paths in (
+            ("MISMATCH", verifier.mismatched),
+            ("MISSING", verifier.missing),
+            ("EXTRA", verifier.extra),
+        ):
+            for path in paths:
+                print(f"{label} {path}")
+        if verifier.ok():
+            sink.config(text="Verification OK")
+            return 0
+        sink.config(text="Verification FAILED")
+        return 1
+
+    has_errors = checksum_folder(
+        args.dir,
+        archiver_list,
+        sink,
+        sink,
+        out_path=args.out,
+        workers=args.workers,
+        archive_processes=args.archive_processes,
+        cache_path=cache_path,
+        resume=args.resume,
+        extra_algorithms=extra_algorithms,
+        nested_depth=args.nested_depth,
+        exclude_patterns=args.exclude,
+        status_path=args.status,
+        metrics_path=metrics_path,
+    )
+    if has_errors:
+        sink.config(
+            text=f"There were errors or warnings during processing: check {error_file}"
+        )
+    sink.config(text="Done: manifest has been created")
+    return 0
 
 
 if __name__ == "__main__":
+    # required for process pools in PyInstaller builds
+    multiprocessing.freeze_support()
+    # the GUI has no options: tracing is turned on from the environment
+    set_verbosity(int(os.environ.get("ACOUA_VERBOSITY") or 0))
+    if len(sys.argv) > 1:
+        sys.exit(main_cli())
     root = tk.Tk()
     current_font = font.nametofont("TkDefaultFont")
     root.wm_title("ACOUA CheckSum v" + version)
@@ -8,9 +8,10 @@ Covers every function that can be tested without a display:
   - open_archive  (file-based: success and corrupt-file paths)
   - log_message
   - handleArchive (zip, tar, and plain-file paths)
+  - checksum_folder and main_cli (headless pipeline)
 
-The GUI entry-point (runchecksum, tk_progress_update, add/remove_archiver)
-requires a running Tk event loop and is not covered here.
+The GUI entry-point (runchecksum, add/remove_archiver) requires a running
+Tk event loop and is not covered here.
 
 Run with:
     pytest test_main.py -v
@@ -18,9 +19,14 @@ Run with:
 
 import hashlib
 import io
+import json
+import logging
+import ntpath
+import os
 import sys
 import tarfile
 import types
+import threading
 import zipfile
 from pathlib import Path
 from unittest.mock import MagicMock
@@ -187,6 +193,101 @@ class TestMd5Checksum2:
         import re
         assert re.fullmatch(r"[0-9a-f]{32}", self.run(b"test"))
 
+    def test_stream_without_readinto(self):
+        class ReadOnly:
+            def __init__(self, data):
+                self.stream = io.BytesIO(data)
+
+            def read(self, size):
+                return self.stream.read(size)
+
+        data = b"Q" * (2**20 + 3)
+        assert main.md5Checksum2(ReadOnly(data)) == md5(data)
+
+    def test_checksums_single_pass(self):
+        data = b"W" * (2**20 + 5)
+        digests = main.checksums(io.BytesIO(data), ("md5", "sha256", "blake2b"))
+        assert digests == {
+            "md5": md5(data),
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "blake2b": hashlib.blake2b(data).hexdigest(),
+        }
+
+    def test_successive_files_of_different_sizes(self, tmp_path):
+        # the read buffer is reused: a smaller file must not see stale data
+        big, small = b"B" * 5000, b"s" * 10
+        for name, data in (("big", big), ("small", small)):
+            (tmp_path / name).write_bytes(data)
+        assert main.md5_file(str(tmp_path / "big")) == {"md5": md5(big)}
+        assert main.md5_file(str(tmp_path / "small")) == {"md5": md5(small)}
+
+
+class TestReadSize:
+
+    def test_memory_stream_uses_default(self):
+        assert main.read_size(io.BytesIO(b"abc")) == main.default_block_size
+
+    def test_small_file_read_in_one_block(self, tmp_path):
+        path = tmp_path / "small.bin"
+        path.write_bytes(b"x" * 10000)
+        with path.open("rb") as fh:
+            size = main.read_size(fh)
+        assert 10000 <= size < 10000 + 2**16
+
+    @pytest.mark.parametrize("size", [4000, 4096, 8192, 2**20])
+    def test_small_file_read_without_thread(self, tmp_path, monkeypatch, size):
+        path = tmp_path / "small.bin"
+        path.write_bytes(b"x" * size)
+
+        def no_thread(*args, **kwargs):
+            raise AssertionError("read-ahead thread started")
+
+        monkeypatch.setattr(main.threading, "Thread", no_thread)
+        assert main.md5_file(str(path)) == {"md5": md5(b"x" * size)}
+
+    def test_huge_file_uses_large_blocks(self, tmp_path):
+        path = tmp_path / "huge.bin"
+        with path.open("wb") as fh:
+            # sparse file: no actual disk usage
+            fh.truncate(main.large_file_size)
+        with path.open("rb") as fh:
+            assert main.read_size(fh) == main.large_block_size
+
+
+class TestReadAhead:
+
+    @pytest.mark.parametrize("depth", [0, 1, 4])
+    def test_same_digest_at_any_depth(self, monkeypatch, depth):
+        monkeypatch.setattr(main, "read_ahead_depth", depth)
+        data = bytes(range(256)) * (2**14) + b"tail"
+        assert main.md5Checksum2(io.BytesIO(data)) == md5(data)
+
+    def test_zip_member_stream(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(main, "default_block_size", 4096)
+        data = bytes(range(256)) * 1000
+        path = make_zip({"big.bin": data}, tmp_path / "big.zip")
+        with zipfile.ZipFile(path) as zf, zf.open("big.bin") as fh:
+            assert main.md5Checksum2(fh) == md5(data)
+
+    def test_read_error_is_raised_and_reader_stops(self):
+        class Failing(io.RawIOBase):
+            calls = 0
+
+            def readable(self):
+                return True
+
+            def readinto(self, buffer):
+                self.calls += 1
+                if self.calls > 2:
+                    raise OSError("network share went away")
+                buffer[:] = b"x" * len(buffer)
+                return len(buffer)
+
+        threads = threading.active_count()
+        with pytest.raises(OSError, match="went away"):
+            main.md5Checksum2(Failing())
+        assert threading.active_count() == threads
+
 
 # ---------------------------------------------------------------------------
 # is_cp850
@@ -399,6 +500,264 @@ class TestOpenArchive:
     #     assert "WARNING" in error_log.read_text()
 
 
+# ---------------------------------------------------------------------------
+# ArchiveSession
+# ---------------------------------------------------------------------------
+
+class TestArchiveSession:
+
+    def test_lists_members_without_directories(self, tmp_path, error_log):
+        path = tmp_path / "test.zip"
+        with zipfile.ZipFile(path, "w") as zf:
+            zf.mkdir("mydir")
+            zf.writestr("mydir/file.txt", b"x")
+        with main.ArchiveSession(str(path), ".zip") as session:
+            assert session.members == ["mydir/file.txt"]
+            assert len(session.infolist) == 2
+
+    def test_handle_is_reused(self, zip_archive, error_log):
+        path, _ = zip_archive
+        with main.ArchiveSession(str(path), ".zip") as session:
+            handle = session.archive
+            assert session.open() is handle
+
+    def test_close_then_reopen(self, zip_archive, error_log):
+        path, content = zip_archive
+        session = main.ArchiveSession(str(path), ".zip")
+        session.close()
+        assert session.archive is None
+        assert session.members == list(content)
+        assert isinstance(session.open(), zipfile.ZipFile)
+        session.close()
+
+    def test_invalid_archive(self, tmp_path, error_log):
+        path = tmp_path / "bad.zip"
+        path.write_bytes(b"not a zip")
+        with main.ArchiveSession(str(path), ".zip") as session:
+            assert session.valid is False
+            assert session.members == []
+            assert session.open() is None
+
+
+# ---------------------------------------------------------------------------
+# Progress reporting
+# ---------------------------------------------------------------------------
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgressReporter:
+
+    def make(self):
+        stream = io.StringIO()
+        sink = main.ConsoleProgress(stream)
+        clock = FakeClock()
+        return main.ProgressReporter(sink, sink, interval=1, clock=clock), clock, stream
+
+    def test_refreshes_at_most_once_per_interval(self):
+        reporter, clock, stream = self.make()
+        reporter.start("Listing")
+        for n in range(1, 41):
+            clock.now = n / 4
+            reporter.advance(n)
+        # 10 seconds: the start, then one refresh per second
+        lines = stream.getvalue().splitlines()
+        assert lines[:3] == ["Listing: 0 files", "Listing: 4 files", "Listing: 8 files"]
+        assert len(lines) == 1 + 10
+
+    def test_rates_and_eta_from_bytes(self):
+        reporter, clock, stream = self.make()
+        reporter.start("Checksum progress", total_files=4, total_bytes=40 * 2**20)
+        clock.now = 2
+        # one small file, but 10 MiB of the 40: the ETA follows the bytes
+        reporter.advance(1, 10 * 2**20)
+        assert stream.getvalue().splitlines()[-1] == (
+            "Checksum progress: 1/4 (25%), 5.0 MB/s, 0 files/s, ETA 0:00:06"
+        )
+
+    def test_bytes_counted_while_hashing(self):
+        reporter, clock, stream = self.make()
+        reporter.start("Checksum progress", total_files=1, total_bytes=8 * 2**20)
+        worker = threading.Thread(target=reporter.count_bytes, args=(2**20,))
+        clock.now = 1
+        worker.start()
+        worker.join()
+        # counted, but the sink is only refreshed from the reporter's thread
+        assert reporter.bytes == 2**20
+        assert stream.getvalue().splitlines() == ["Checksum progress: 0/1 (0%)"]
+        main.set_byte_callback(reporter.count_bytes)
+        try:
+            main.checksums(io.BytesIO(b"x" * 2**20), ("md5",))
+        finally:
+            main.set_byte_callback(None)
+        assert reporter.bytes == 2 * 2**20
+
+    def test_rates_and_eta_inside_a_huge_file(self, tmp_path):
+        stream = io.StringIO()
+        sink = main.ConsoleProgress(stream)
+        clock = FakeClock()
+        status_path = str(tmp_path / "status.json")
+        reporter = main.ProgressReporter(
+            sink, sink, interval=1, clock=clock, status_path=status_path
+        )
+        reporter.start("Checksum progress", total_files=2, total_bytes=400 * 2**30)
+        for n in range(1, 6):
+            clock.now = 10 * n
+            reporter.count_bytes(10 * 2**30)
+        # no file done yet: 50 of 400 GiB at 1 GiB/s
+        assert stream.getvalue().splitlines()[-1] == (
+            "Checksum progress: 0/2 (12%), 1024.0 MB/s, 0 files/s, ETA 0:05:50"
+        )
+        status = json.loads((tmp_path / "status.json").read_text())
+        assert status["bytes_per_second"] == 2**30
+        assert status["eta_seconds"] == 350
+
+    def test_byte_rate_is_smoothed(self, monkeypatch):
+        monkeypatch.setattr(main, "rate_smoothing", 0.5)
+        reporter, clock, stream = self.make()
+        reporter.start("Checksum progress", total_files=3, total_bytes=100 * 2**20)
+        clock.now = 1
+        reporter.advance(1, 10 * 2**20)
+        clock.now = 2
+        reporter.advance(2, 30 * 2**20)
+        # (10 + 30) / 2 MB/s, then 60 MiB left
+        assert stream.getvalue().splitlines()[-1] == (
+            "Checksum progress: 2/3 (40%), 20.0 MB/s, 1 files/s, ETA 0:00:03"
+        )
+
+    def test_status_file(self, tmp_path):
+        stream = io.StringIO()
+        sink = main.ConsoleProgress(stream)
+        clock = FakeClock()
+        status_path = str(tmp_path / "status.json")
+        reporter = main.ProgressReporter(
+            sink, sink, interval=1, clock=clock, status_path=status_path
+        )
+        reporter.start("Listing")
+        clock.now = 2
+        reporter.start("Checksum progress", total_files=2, total_bytes=2**20)
+        clock.now = 3
+        reporter.advance(1, 2**19)
+        status = json.loads((tmp_path / "status.json").read_text())
+        assert status["state"] == "running"
+        assert status["phase"] == "Checksum progress"
+        assert (status["files"], status["bytes"]) == (1, 2**19)
+        assert status["eta_seconds"] == 1
+        assert status["phases"] == {"Listing": 2}
+        clock.now = 5
+        assert reporter.finish() == "listing 0:00:02, checksum progress 0:00:03"
+        status = json.loads((tmp_path / "status.json").read_text())
+        assert status["state"] == "done"
+        assert status["phases"] == {"Listing": 2, "Checksum progress": 3}
+
+    def test_checksum_folder_counts_every_byte(self, dataset, tmp_path):
+        sink = main.ConsoleProgress(io.StringIO())
+        status_path = dataset / "status.json"
+        cache_path = str(tmp_path / "cache.sqlite")
+        for run in range(2):
+            # the second run takes everything from the cache
+            main.checksum_folder(
+                str(dataset),
+                [".zip"],
+                sink,
+                sink,
+                cache_path=cache_path,
+                status_path=str(status_path),
+            )
+            status = json.loads(status_path.read_text())
+            assert status["state"] == "done"
+            assert status["bytes"] == status["total_bytes"] > 0
+        assert ".\\status.json" not in read_manifest(dataset / main.out_file)
+
+    def test_sink_for_handle_archive(self, zip_archive, error_log):
+        path, content = zip_archive
+        reporter, clock, stream = self.make()
+        reporter.start("Checksum progress", total_files=len(content))
+        with zipfile.ZipFile(path) as zf:
+            main.handleArchive(list(content), zf, len(content), 0, 1, reporter, reporter)
+        # members were hashed within the interval: no refresh
+        assert stream.getvalue().splitlines()[-1] == f"Checksum progress: 0/{len(content)}"
+        assert reporter.files == len(content)
+
+    def test_gui_poll_shows_queued_progress(self):
+        events = main.queue.Queue()
+        sink = main.QueuedProgress(events)
+        sink.config(text="Listing: 5 files")
+        tkroot, progress_info = MagicMock(), MagicMock()
+        main.poll_checksum_events(tkroot, events, progress_info, "errors")
+        progress_info.config.assert_called_once_with(text="Listing: 5 files")
+        # polled again later from the Tk main loop, until the run is done
+        assert tkroot.after.call_args[0][0] == main.gui_poll_interval
+        events.put(("done", False))
+        tkroot.after.reset_mock()
+        main.poll_checksum_events(tkroot, events, progress_info, "errors")
+        tkroot.after.assert_not_called()
+
+
+class TestTracing:
+
+    @pytest.fixture()
+    def traced(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = lambda record: records.append(record.getMessage())
+        main.trace_logger.addHandler(handler)
+        yield records
+        main.trace_logger.removeHandler(handler)
+        main.set_verbosity(0)
+
+    def test_off_by_default_and_lazy(self, traced):
+        class Unprintable:
+            def __str__(self):
+                raise AssertionError("formatted while tracing is off")
+
+        main.debug("processing %s", Unprintable())
+        with main.trace_span("phase"):
+            pass
+        assert traced == []
+
+    def test_phase_timings_at_verbosity_1(self, traced, dataset):
+        main.set_verbosity(1)
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        assert "listing: start" in traced
+        assert any(message.startswith("archives: ") for message in traced[1:])
+        assert not any(message.startswith("processing") for message in traced)
+
+    def test_every_file_at_verbosity_2(self, traced, dataset):
+        main.set_verbosity(2)
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        assert "processing ./metadata.xml" in traced
+
+
+class TestRunMetrics:
+
+    def test_phases_add_up(self):
+        metrics = main.RunMetrics()
+        metrics.add_phase("walk", 1.5)
+        metrics.add_phase("walk", 0.5, 2**20)
+        with metrics.phase("manifest write"):
+            pass
+        phases = metrics.report()["phases"]
+        assert phases["walk"] == {"seconds": 2.0, "bytes": 2**20, "mb_per_s": 0.5}
+        assert phases["manifest write"]["bytes"] == 0
+
+    def test_keeps_top_slowest(self):
+        metrics = main.RunMetrics(top=2)
+        for n, seconds in enumerate([0.1, 0.4, 0.2, 0.3]):
+            metrics.add_work("loose hashing", "file", f"./f{n}", seconds, 10)
+        report = metrics.report()
+        assert [entry["path"] for entry in report["slowest"]] == ["./f1", "./f3"]
+        assert report["work"]["loose hashing"]["count"] == 4
+        assert report["work"]["loose hashing"]["bytes"] == 40
+
+
 # ---------------------------------------------------------------------------
 # log_message
 # ---------------------------------------------------------------------------
@@ -425,6 +784,57 @@ class TestLogMessage:
         main.log_message("appended")
         assert log.read_text() == "existing\nappended\n"
 
+    def test_buffered_during_a_run(self, tmp_path):
+        log = tmp_path / "log.txt"
+        main.start_error_log(str(log))
+        try:
+            main.log_message("first")
+            main.log_message("second", logging.ERROR)
+            assert not log.exists()
+        finally:
+            main.stop_error_log()
+        assert log.read_text() == "first\nsecond\n"
+
+    def test_flushes_when_buffer_is_full(self, tmp_path):
+        log = tmp_path / "log.txt"
+        handler = main.BufferedLogHandler(str(log), capacity=3, flush_interval=3600)
+        logger = logging.getLogger("acouachecksum.test")
+        logger.addHandler(handler)
+        try:
+            for n in range(4):
+                logger.warning(f"line {n}")
+            assert log.read_text() == "line 0\nline 1\nline 2\n"
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+        assert log.read_text().splitlines()[-1] == "line 3"
+
+    def test_thread_safe(self, tmp_path):
+        log = tmp_path / "log.txt"
+        main.start_error_log(str(log))
+
+        def log_many(n):
+            for i in range(500):
+                main.log_message(f"thread {n} message {i}")
+
+        threads = [threading.Thread(target=log_many, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        main.stop_error_log()
+        lines = log.read_text().splitlines()
+        assert len(lines) == len(set(lines)) == 8 * 500
+
+    def test_run_with_warnings_keeps_error_file(self, dataset):
+        (dataset / ("x" * 200)).mkdir()
+        (dataset / ("x" * 200) / ("y" * 100)).write_bytes(b"long")
+        sink = main.ConsoleProgress(io.StringIO())
+        assert main.checksum_folder(str(dataset), [".zip"], sink, sink) is True
+        content = (dataset / main.error_file).read_text()
+        assert content.startswith(main.error_file_header)
+        assert "WARNING > 260 chars" in content
+
 
 # ---------------------------------------------------------------------------
 # handleArchive — zip
@@ -470,6 +880,70 @@ class TestHandleArchiveZip:
             )
         assert progress == 5 + len(content)
 
+    @pytest.fixture()
+    def mixed_zip(self, tmp_path):
+        """Stored and deflated members, with extra fields in local headers."""
+        content = {
+            "stored/big.tif": bytes(range(256)) * 5000,
+            "deflated.txt": b"compress me " * 100,
+            "stored/empty.jpg": b"",
+        }
+        path = tmp_path / "mixed.zip"
+        with zipfile.ZipFile(path, "w") as zf:
+            for name, data in content.items():
+                info = zipfile.ZipInfo(name)
+                if name.endswith(".txt"):
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                info.extra = b"\xca\xfe\x04\x00abcd"
+                zf.writestr(info, data)
+        return path, content
+
+    def test_stored_members_read_raw(self, mixed_zip, null_tk, error_log, monkeypatch):
+        path, content = mixed_zip
+        pi, tk = null_tk
+        opened = []
+        with zipfile.ZipFile(path) as zf:
+            zip_open = zf.open
+            monkeypatch.setattr(
+                zf, "open", lambda info, *a: opened.append(info) or zip_open(info, *a)
+            )
+            md5list, _ = main.handleArchive(
+                list(content), zf, len(content), 0, 1, pi, tk
+            )
+        assert md5list == [(name, md5(data)) for name, data in content.items()]
+        assert [info.filename for info in opened] == ["deflated.txt"]
+
+    def test_members_read_in_offset_order(
+        self, mixed_zip, null_tk, error_log, monkeypatch
+    ):
+        path, content = mixed_zip
+        pi, tk = null_tk
+        names = list(reversed(list(content)))
+        read = []
+        member_entries = main.member_entries
+
+        def spy(name, fh, depth, algorithms):
+            read.append(name)
+            return member_entries(name, fh, depth, algorithms)
+
+        monkeypatch.setattr(main, "member_entries", spy)
+        with zipfile.ZipFile(path) as zf:
+            md5list, _ = main.handleArchive(names, zf, len(names), 0, 1, pi, tk)
+        assert read == list(content)
+        # the result still follows the requested order
+        assert [name for name, _ in md5list] == names
+
+    def test_stored_member_crc_checked(self, mixed_zip, null_tk):
+        path, content = mixed_zip
+        data = bytearray(path.read_bytes())
+        offset = data.index(bytes(range(256)))
+        data[offset] ^= 0xFF
+        path.write_bytes(bytes(data))
+        pi, tk = null_tk
+        with zipfile.ZipFile(path) as zf:
+            with pytest.raises(zipfile.BadZipFile, match="CRC"):
+                main.handleArchive(["stored/big.tif"], zf, 1, 0, 1, pi, tk)
+
 
 # ---------------------------------------------------------------------------
 # handleArchive — tar
@@ -507,6 +981,54 @@ class TestHandleArchiveTar:
         assert "wanted.txt" in names
         assert "unwanted.txt" not in names
 
+    def make_tar_gz(self, dest):
+        content = {f"d/m{n:03}.bin": bytes([n]) * 5000 for n in range(50)}
+        with tarfile.open(dest, "w:gz") as tf:
+            for name, data in content.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+            for name, kind, target in (
+                ("hard", tarfile.LNKTYPE, "d/m001.bin"),
+                ("d/sym", tarfile.SYMTYPE, "m002.bin"),
+            ):
+                info = tarfile.TarInfo(name)
+                info.type, info.linkname = kind, target
+                tf.addfile(info)
+        content["hard"], content["d/sym"] = content["d/m001.bin"], content["d/m002.bin"]
+        return content
+
+    @pytest.mark.parametrize("listed", [False, True])
+    def test_compressed_tar_never_seeks_backwards(
+        self, tmp_path, null_tk, error_log, monkeypatch, listed
+    ):
+        import gzip
+
+        content = self.make_tar_gz(tmp_path / "t.tar.gz")
+        rewinds = []
+        real_rewind = gzip._GzipReader._rewind
+
+        def counting_rewind(self):
+            rewinds.append(self)
+            real_rewind(self)
+
+        monkeypatch.setattr(gzip._GzipReader, "_rewind", counting_rewind)
+        pi, tk = null_tk
+        with tarfile.open(tmp_path / "t.tar.gz") as tf:
+            if listed:
+                # as after the listing phase: back to the start, once
+                tf.getmembers()
+            md5list, progress = main.handleArchive(
+                list(content), tf,
+                total_files=len(content), progress=0,
+                progress_update_frequency=1,
+                progress_info=pi, tkroot=tk,
+            )
+        assert len(rewinds) == (1 if listed else 0)
+        assert dict(md5list) == {name: md5(data) for name, data in content.items()}
+        assert [name for name, _ in md5list][-2:] == ["hard", "d/sym"]
+        assert progress == len(content)
+
 # ---------------------------------------------------------------------------
 # handleArchive — rar
 # ---------------------------------------------------------------------------
@@ -531,6 +1053,66 @@ class TestHandleArchiveRar:
             assert result[name] == md5(data)
 
 
+# ---------------------------------------------------------------------------
+# handleArchive — 7z
+# ---------------------------------------------------------------------------
+
+class TestHandleArchive7z:
+
+    def test_checksums_all_files(self, tmp_path, null_tk, error_log):
+        content = {
+            "a.txt": b"content of file a",
+            "sub/b.bin": bytes(range(256)) * 5000,
+            "empty.txt": b"",
+        }
+        path = make_7z(content, tmp_path / "test.7z")
+        pi, tk = null_tk
+        with py7zr.SevenZipFile(path) as sz:
+            md5list, progress = main.handleArchive(
+                list(content), sz,
+                total_files=len(content), progress=0,
+                progress_update_frequency=1,
+                progress_info=pi, tkroot=tk,
+            )
+        assert dict(md5list) == {name: md5(data) for name, data in content.items()}
+        assert progress == len(content)
+
+    def test_skips_files_not_in_filelist(self, tmp_path, null_tk, error_log):
+        path = make_7z({"wanted.txt": b"yes", "unwanted.txt": b"no"}, tmp_path / "t.7z")
+        pi, tk = null_tk
+        with py7zr.SevenZipFile(path) as sz:
+            md5list, _ = main.handleArchive(
+                ["wanted.txt"], sz,
+                total_files=1, progress=0,
+                progress_update_frequency=1,
+                progress_info=pi, tkroot=tk,
+            )
+        assert md5list == [("wanted.txt", md5(b"yes"))]
+
+    def test_several_algorithms(self, tmp_path, null_tk, error_log):
+        path = make_7z({"a.txt": b"seven"}, tmp_path / "t.7z")
+        pi, tk = null_tk
+        with py7zr.SevenZipFile(path) as sz:
+            md5list, _ = main.handleArchive(
+                ["a.txt"], sz,
+                total_files=1, progress=0,
+                progress_update_frequency=1,
+                progress_info=pi, tkroot=tk,
+                algorithms=("md5", "sha256"),
+            )
+        assert md5list == [
+            ("a.txt", {"md5": md5(b"seven"), "sha256": hashlib.sha256(b"seven").hexdigest()})
+        ]
+
+    def test_digest_io_keeps_no_data(self):
+        writer = main.DigestIO("x.bin")
+        writer.write(b"abc")
+        writer.write(b"def")
+        assert writer.size() == 6
+        assert writer.read() == b""
+        assert writer.hexdigest() == md5(b"abcdef")
+
+
 # ---------------------------------------------------------------------------
 # handleArchive — plain file (no archive)
 # ---------------------------------------------------------------------------
@@ -552,3 +1134,966 @@ class TestHandleArchivePlainFile:
         assert md5list[0][0] == str(f)
         assert md5list[0][1] == md5(data)
         assert progress == 1
+
+
+# ---------------------------------------------------------------------------
+# Nested archives
+# ---------------------------------------------------------------------------
+
+def make_tar_gz(files: dict[str, bytes], dest: Path) -> Path:
+    with tarfile.open(dest, "w:gz") as tf:
+        for name, content in files.items():
+            ti = tarfile.TarInfo(name=name)
+            ti.size = len(content)
+            tf.addfile(ti, io.BytesIO(content))
+    return dest
+
+
+class TestNestedArchives:
+
+    @pytest.fixture()
+    def nested_zip(self, tmp_path):
+        """outer.zip holding top.txt and sub/inner.zip, itself holding a.txt
+        and deep/innermost.zip."""
+        make_zip({"b.txt": b"innermost b"}, tmp_path / "innermost.zip")
+        make_zip(
+            {
+                "a.txt": b"inner a",
+                "deep/innermost.zip": (tmp_path / "innermost.zip").read_bytes(),
+            },
+            tmp_path / "inner.zip",
+        )
+        return make_zip(
+            {
+                "top.txt": b"top",
+                "sub/inner.zip": (tmp_path / "inner.zip").read_bytes(),
+            },
+            tmp_path / "outer.zip",
+        )
+
+    def hash_all(self, path, extension, depth):
+        sink = main.NullProgress()
+        with main.ArchiveSession(str(path), extension, nested_depth=depth) as s:
+            md5list, progress = main.handleArchive(
+                s.members, s.open(), len(s.leaves), 0, 1, sink, sink, depth=depth
+            )
+        assert progress == len(md5list) == len(s.leaves)
+        assert [name for name, _ in md5list] == s.leaves
+        return dict(md5list)
+
+    def test_depth_zero_hashes_nested_archive(self, nested_zip, tmp_path, error_log):
+        assert self.hash_all(nested_zip, ".zip", 0) == {
+            "top.txt": md5(b"top"),
+            "sub/inner.zip": md5((tmp_path / "inner.zip").read_bytes()),
+        }
+
+    def test_depth_limit(self, nested_zip, tmp_path, error_log):
+        assert self.hash_all(nested_zip, ".zip", 1) == {
+            "top.txt": md5(b"top"),
+            "sub/a.txt": md5(b"inner a"),
+            "sub/deep/innermost.zip": md5((tmp_path / "innermost.zip").read_bytes()),
+        }
+        assert self.hash_all(nested_zip, ".zip", 2) == {
+            "top.txt": md5(b"top"),
+            "sub/a.txt": md5(b"inner a"),
+            "sub/deep/b.txt": md5(b"innermost b"),
+        }
+
+    @pytest.mark.parametrize("depth", [0, 1])
+    def test_corrupt_nested_member(self, dataset, depth):
+        make_zip({"x.txt": bytes(range(256)) * 64}, dataset / "in.zip")
+        inner = (dataset / "in.zip").read_bytes()
+        (dataset / "in.zip").unlink()
+        path = dataset / "outer.zip"
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr("ok.txt", b"ok")
+            zf.writestr("in.zip", inner)
+        with zipfile.ZipFile(path) as zf:
+            info = zf.getinfo("in.zip")
+        data = bytearray(path.read_bytes())
+        # corrupt the deflated data of in.zip, after its local header
+        start = info.header_offset + 30 + len(info.filename) + 10
+        data[start : start + 20] = b"\xff" * 20
+        path.write_bytes(bytes(data))
+        sink = main.ConsoleProgress(io.StringIO())
+        # logged as at depth 0, where the error is only met when hashing
+        assert main.checksum_folder(
+            str(dataset), [".zip"], sink, sink, nested_depth=depth
+        )
+        assert ".\\metadata.xml" in read_manifest(dataset / main.out_file)
+        errors = (dataset / main.error_file).read_text()
+        assert "Bad CRC-32 for file 'in.zip'" in errors
+        assert ("Cannot list in.zip" in errors) == (depth == 1)
+
+    def test_tar_gz_in_7z(self, tmp_path, error_log):
+        inner = make_tar_gz({"x/t.txt": b"tarred"}, tmp_path / "inner.tar.gz")
+        outer = make_7z(
+            {"other.txt": b"other", "p/inner.tar.gz": inner.read_bytes()},
+            tmp_path / "outer.7z",
+        )
+        assert self.hash_all(outer, ".7z", 1) == {
+            "other.txt": md5(b"other"),
+            "p/x/t.txt": md5(b"tarred"),
+        }
+
+    def test_zip_in_tar(self, tmp_path, error_log):
+        inner = make_zip({"z.txt": b"zipped"}, tmp_path / "inner.zip")
+        outer = make_tar({"d/inner.zip": inner.read_bytes()}, tmp_path / "outer.tar")
+        assert self.hash_all(outer, ".tar", 1) == {"d/z.txt": md5(b"zipped")}
+
+    def test_invalid_nested_archive_is_a_file(self, tmp_path, error_log):
+        outer = make_zip(
+            {"fake.zip": b"not a zip", "fake.tar.gz": b"not a tar either"},
+            tmp_path / "outer.zip",
+        )
+        assert self.hash_all(outer, ".zip", 1) == {
+            "fake.zip": md5(b"not a zip"),
+            "fake.tar.gz": md5(b"not a tar either"),
+        }
+        assert "fake.zip is not a valid .zip file" in error_log.read_text()
+
+    def test_spool_spills_to_disk(self, nested_zip, monkeypatch, error_log):
+        monkeypatch.setattr(main, "nested_memory_cap", 16)
+        spools = []
+        spooled_file = main.tempfile.SpooledTemporaryFile
+
+        def spy(*args, **kwargs):
+            spools.append(spooled_file(*args, **kwargs))
+            return spools[-1]
+
+        monkeypatch.setattr(main.tempfile, "SpooledTemporaryFile", spy)
+        assert self.hash_all(nested_zip, ".zip", 2)["sub/deep/b.txt"] == md5(
+            b"innermost b"
+        )
+        assert spools and all(spool._rolled for spool in spools)
+
+    def test_checksum_folder(self, dataset, tmp_path):
+        make_zip({"z.txt": b"zipped z"}, tmp_path / "nested.zip")
+        make_zip(
+            {"n/nested.zip": (tmp_path / "nested.zip").read_bytes()},
+            dataset / "outer.zip",
+        )
+        sink = main.ConsoleProgress(io.StringIO())
+        manifests = []
+        for processes in (0, 2):
+            main.checksum_folder(
+                str(dataset),
+                [".zip"],
+                sink,
+                sink,
+                archive_processes=processes,
+                nested_depth=1,
+            )
+            manifests.append((dataset / main.out_file).read_bytes())
+        assert manifests[0] == manifests[1]
+        manifest = read_manifest(dataset / main.out_file)
+        assert manifest[".\\n\\z.txt"] == md5(b"zipped z")
+        assert ".\\n\\nested.zip" not in manifest
+
+    def test_cache_depends_on_depth(self, dataset, tmp_path):
+        make_zip({"z.txt": b"zipped z"}, tmp_path / "nested.zip")
+        make_zip(
+            {"nested.zip": (tmp_path / "nested.zip").read_bytes()},
+            dataset / "outer.zip",
+        )
+        sink = main.ConsoleProgress(io.StringIO())
+        cache_path = str(tmp_path / "cache.sqlite")
+        for depth in (0, 1):
+            main.checksum_folder(
+                str(dataset),
+                [".zip"],
+                sink,
+                sink,
+                cache_path=cache_path,
+                nested_depth=depth,
+            )
+        assert read_manifest(dataset / main.out_file)[".\\z.txt"] == md5(b"zipped z")
+
+
+# ---------------------------------------------------------------------------
+# checksum_folder / main_cli — headless pipeline
+# ---------------------------------------------------------------------------
+
+@pytest.fixture()
+def dataset(tmp_path, monkeypatch):
+    """An ingestion folder with loose files, a sub-folder and a zip archive."""
+    # checksum_folder() changes the working directory: restore it afterwards
+    monkeypatch.chdir(tmp_path)
+    root = tmp_path / "dataset"
+    (root / "sub").mkdir(parents=True)
+    (root / "metadata.xml").write_bytes(b"<xml/>")
+    (root / "sub" / "data.bin").write_bytes(b"some data")
+    (root / ".DS_Store").write_bytes(b"junk")
+    make_zip({"inner/a.txt": b"zipped a"}, root / "sub" / "pack.zip")
+    return root
+
+
+def read_manifest(path: Path) -> dict[str, str]:
+    lines = path.read_bytes().decode("utf-8").splitlines()
+    return {line[33:]: line[:32] for line in lines}
+
+
+class TestChecksumFolder:
+
+    def test_manifest_content(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        manifest = read_manifest(dataset / main.out_file)
+        assert manifest == {
+            ".\\metadata.xml": md5(b"<xml/>"),
+            ".\\sub\\data.bin": md5(b"some data"),
+            ".\\sub\\inner\\a.txt": md5(b"zipped a"),
+        }
+
+    def test_archives_as_plain_files(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [], sink, sink)
+        manifest = read_manifest(dataset / main.out_file)
+        zip_md5 = md5((dataset / "sub" / "pack.zip").read_bytes())
+        assert manifest[".\\sub\\pack.zip"] == zip_md5
+        assert ".\\sub\\inner\\a.txt" not in manifest
+
+    def test_no_errors_removes_error_file(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        assert main.checksum_folder(str(dataset), [".zip"], sink, sink) is False
+        assert not (dataset / main.error_file).exists()
+
+    def test_custom_output_path(self, dataset, tmp_path):
+        sink = main.ConsoleProgress(io.StringIO())
+        out = tmp_path / "elsewhere.md5"
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, out_path=str(out))
+        assert ".\\metadata.xml" in read_manifest(out)
+        assert not (dataset / main.out_file).exists()
+
+    def test_rerun_excludes_previous_manifest(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        manifest = read_manifest(dataset / main.out_file)
+        assert ".\\" + main.out_file not in manifest
+
+    def test_progress_reaches_total(self, dataset):
+        stream = io.StringIO()
+        sink = main.ConsoleProgress(stream)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        assert stream.getvalue().splitlines()[-1] == (
+            "Progress: 3/3 (listing 0:00:00, checksum progress 0:00:00)"
+        )
+
+
+    def test_metrics_report(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        metrics_path = dataset / "metrics.json"
+        for _ in range(2):
+            main.checksum_folder(
+                str(dataset), [".zip"], sink, sink, metrics_path=str(metrics_path)
+            )
+        report = json.loads(metrics_path.read_text())
+        assert {
+            "walk",
+            "exclusion",
+            "collision check",
+            "archive listing .zip",
+            "listing",
+            "loose files",
+            "archives",
+            "manifest write",
+        } <= set(report["phases"])
+        assert report["phases"]["loose files"]["bytes"] == len(b"<xml/>some data")
+        assert report["work"]["loose hashing"]["count"] == 2
+        assert report["work"]["archive hashing .zip"]["bytes"] == len(b"zipped a")
+        assert {entry["path"] for entry in report["slowest"]} == {
+            "./metadata.xml",
+            "./sub/data.bin",
+            "./sub/pack.zip",
+        }
+        # the report of the first run is not part of the dataset
+        assert ".\\metrics.json" not in read_manifest(dataset / main.out_file)
+
+    def test_unreadable_file_is_logged(self, dataset):
+        (dataset / "sub" / "broken").symlink_to(dataset / "nonexistent")
+        (dataset / "sub" / "broken.zip").symlink_to(dataset / "nonexistent.zip")
+        sink = main.ConsoleProgress(io.StringIO())
+        assert main.checksum_folder(str(dataset), [".zip"], sink, sink) is True
+        assert len(read_manifest(dataset / main.out_file)) == 3
+        errors = (dataset / main.error_file).read_text()
+        assert errors.count("Cannot read ") == 2
+
+    def test_failed_listing_status(self, dataset, tmp_path, monkeypatch):
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        manifest = str(dataset / main.out_file)
+        status_path = tmp_path / "status.json"
+
+        def interrupted(*args, **kwargs):
+            raise KeyboardInterrupt
+
+        monkeypatch.setattr(main, "scan_folder", interrupted)
+        for run in (main.checksum_folder, main.verify_folder):
+            args = [manifest] if run is main.verify_folder else []
+            with pytest.raises(KeyboardInterrupt):
+                run(
+                    str(dataset), *args, [".zip"], sink, sink, status_path=str(status_path)
+                )
+            assert json.loads(status_path.read_text())["state"] == "failed"
+            assert main.error_log_handler is None
+            status_path.unlink()
+
+    def test_manifest_independent_of_workers(self, dataset):
+        for n in range(20):
+            (dataset / f"file{n:02}.txt").write_bytes(b"x" * n)
+        sink = main.ConsoleProgress(io.StringIO())
+        manifests = []
+        for workers in (1, 8):
+            main.checksum_folder(str(dataset), [".zip"], sink, sink, workers=workers)
+            manifests.append((dataset / main.out_file).read_bytes())
+        assert manifests[0] == manifests[1]
+
+    def test_archive_processes_match_serial_run(self, dataset, monkeypatch):
+        make_zip(
+            {f"many/m{n:03}.txt": bytes([n]) * n for n in range(25)},
+            dataset / "many.zip",
+        )
+        make_tar({"t.txt": b"tarred"}, dataset / "sub" / "t.tar")
+        monkeypatch.setattr(main, "archive_chunk_members", 10)
+        sink = main.ConsoleProgress(io.StringIO())
+        manifests = []
+        for processes in (0, 2):
+            main.checksum_folder(
+                str(dataset), [".zip", ".tar"], sink, sink, archive_processes=processes
+            )
+            manifests.append((dataset / main.out_file).read_bytes())
+        assert manifests[0] == manifests[1]
+        assert len(manifests[0].splitlines()) == 2 + 1 + 25 + 1
+
+    @pytest.mark.parametrize("processes", [0, 2])
+    def test_archive_warnings_are_logged(self, dataset, processes):
+        with tarfile.open(dataset / "t.tar", "w") as tf:
+            fifo = tarfile.TarInfo("fifo")
+            fifo.type = tarfile.FIFOTYPE
+            tf.addfile(fifo)
+        sink = main.ConsoleProgress(io.StringIO())
+        assert main.checksum_folder(
+            str(dataset), [".tar"], sink, sink, archive_processes=processes
+        )
+        errors = (dataset / main.error_file).read_text()
+        assert errors.count("fifo in ") == 1
+        assert errors.startswith(main.error_file_header)
+
+    def test_sidecar_manifests(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        md5_only = (dataset / main.out_file).read_bytes()
+        main.checksum_folder(
+            str(dataset), [".zip"], sink, sink, extra_algorithms=["sha256"]
+        )
+        # the MD5 manifest does not change, nor list the sidecar
+        assert (dataset / main.out_file).read_bytes() == md5_only
+        lines = (dataset / "ACOUA_md5.sha256").read_bytes().decode().splitlines()
+        sidecar = dict(reversed(line.split(" ", 1)) for line in lines)
+        assert sidecar == {
+            ".\\metadata.xml": hashlib.sha256(b"<xml/>").hexdigest(),
+            ".\\sub\\data.bin": hashlib.sha256(b"some data").hexdigest(),
+            ".\\sub\\inner\\a.txt": hashlib.sha256(b"zipped a").hexdigest(),
+        }
+
+
+class TestChecksumCache:
+
+    def test_file_roundtrip_and_signature_change(self, tmp_path):
+        cache = main.ChecksumCache(str(tmp_path / "cache.sqlite"))
+        cache.store("./a.txt", (1, 2, 3), {"md5": "abc"})
+        assert cache.lookup("./a.txt", (1, 2, 3)) == {"md5": "abc"}
+        assert cache.lookup("./a.txt", (1, 2, 4)) is None
+        assert cache.lookup("./b.txt", (1, 2, 3)) is None
+        cache.close()
+
+    def test_persists_across_connections(self, tmp_path):
+        cache = main.ChecksumCache(str(tmp_path / "cache.sqlite"))
+        cache.store("./a.txt", (1, 2, 3), {"md5": "abc"})
+        cache.close()
+        cache = main.ChecksumCache(str(tmp_path / "cache.sqlite"))
+        assert cache.lookup("./a.txt", (1, 2, 3)) == {"md5": "abc"}
+        cache.close()
+
+    def test_archive_members(self, tmp_path):
+        cache = main.ChecksumCache(str(tmp_path / "cache.sqlite"))
+        cache.store_archive("./a.zip", (1, 2, 3), [("m1", "x"), ("m2", "y")])
+        assert cache.lookup_archive("./a.zip", (1, 2, 3), ["m2"]) == [("m2", "y")]
+        # all members must be cached
+        assert cache.lookup_archive("./a.zip", (1, 2, 3), ["m1", "m3"]) is None
+        # a new version of the archive replaces the old members
+        cache.store_archive("./a.zip", (5, 6, 7), [("m3", "z")])
+        assert cache.lookup_archive("./a.zip", (1, 2, 3), ["m1"]) is None
+        assert cache.lookup_archive("./a.zip", (5, 6, 7), ["m3"]) == [("m3", "z")]
+        cache.close()
+
+    @pytest.mark.parametrize("processes", [0, 2])
+    def test_rerun_uses_cache(self, dataset, monkeypatch, processes):
+        sink = main.ConsoleProgress(io.StringIO())
+        cache_path = str(dataset / main.cache_file)
+        kwargs = dict(cache_path=cache_path, archive_processes=processes)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, **kwargs)
+        first = (dataset / main.out_file).read_bytes()
+        assert main.cache_file not in first.decode()
+
+        def no_hashing(*args, **kwargs):
+            raise AssertionError("unchanged data hashed again")
+
+        monkeypatch.setattr(main, "md5_file", no_hashing)
+        monkeypatch.setattr(main, "handleArchive", no_hashing)
+        monkeypatch.setattr(main, "hash_archive_task", no_hashing)
+        # hits are not written back to the cache, only to the run journal
+        monkeypatch.setattr(main.ChecksumCache, "store", no_hashing)
+        monkeypatch.setattr(main.ChecksumCache, "store_archive", no_hashing)
+        journaled = []
+
+        def journal_write(journal, record):
+            journaled.append(record)
+
+        monkeypatch.setattr(main.RunJournal, "write", journal_write)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, **kwargs)
+        assert (dataset / main.out_file).read_bytes() == first
+        assert len(journaled) == 3
+
+    def test_cache_excluded_from_runs_without_it(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        cache_path = str(dataset / main.cache_file)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, cache_path=cache_path)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        manifest = read_manifest(dataset / main.out_file)
+        assert ".\\" + main.cache_file not in manifest
+        assert len(manifest) == 3
+
+    def test_changed_file_is_hashed_again(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        cache_path = str(dataset / main.cache_file)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, cache_path=cache_path)
+        (dataset / "metadata.xml").write_bytes(b"<xml>changed</xml>")
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, cache_path=cache_path)
+        manifest = read_manifest(dataset / main.out_file)
+        assert manifest[".\\metadata.xml"] == md5(b"<xml>changed</xml>")
+
+    def test_new_algorithm_is_not_served_from_cache(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        cache_path = str(dataset / main.cache_file)
+        cache = main.ChecksumCache(cache_path)
+        cache.store("./a.txt", (1, 2, 3), {"md5": "abc"})
+        assert main.ChecksumStores([cache]).lookup("./a.txt", (1, 2, 3))
+        stores = main.ChecksumStores([cache], ("md5", "sha256"))
+        assert stores.lookup("./a.txt", (1, 2, 3)) is None
+        cache.close()
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, cache_path=cache_path)
+        main.checksum_folder(
+            str(dataset), [".zip"], sink, sink,
+            cache_path=cache_path, extra_algorithms=["sha256"],
+        )
+        sidecar = (dataset / "ACOUA_md5.sha256").read_bytes().decode()
+        assert hashlib.sha256(b"<xml/>").hexdigest() in sidecar
+
+
+class TestRunJournal:
+
+    def test_resume_loads_previous_records(self, tmp_path):
+        path = str(tmp_path / "out.md5.journal")
+        journal = main.RunJournal(path)
+        journal.store("./a.txt", (1, 2, 3), "abc")
+        journal.store_archive("./a.zip", (4, 5, 6), [("m1", "x")])
+        journal.close()
+        journal = main.RunJournal(path, resume=True)
+        assert journal.lookup("./a.txt", (1, 2, 3)) == "abc"
+        assert journal.lookup("./a.txt", (9, 2, 3)) is None
+        assert journal.lookup_archive("./a.zip", (4, 5, 6), ["m1"]) == [("m1", "x")]
+        journal.close()
+
+    def test_without_resume_starts_empty(self, tmp_path):
+        path = str(tmp_path / "out.md5.journal")
+        journal = main.RunJournal(path)
+        journal.store("./a.txt", (1, 2, 3), "abc")
+        journal.close()
+        journal = main.RunJournal(path)
+        assert journal.lookup("./a.txt", (1, 2, 3)) is None
+        journal.close()
+
+    def test_ignores_truncated_last_line(self, tmp_path):
+        path = tmp_path / "out.md5.journal"
+        journal = main.RunJournal(str(path))
+        journal.store("./a.txt", (1, 2, 3), "abc")
+        journal.close()
+        with path.open("a") as fh:
+            fh.write('{"path": "./b.t')
+        journal = main.RunJournal(str(path), resume=True)
+        assert journal.lookup("./a.txt", (1, 2, 3)) == "abc"
+        journal.close()
+
+    def test_completed_run_removes_journal(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        assert not (dataset / (main.out_file + ".journal")).exists()
+
+    def test_resumed_run_matches_uninterrupted_run(self, dataset, monkeypatch):
+        for n in range(10):
+            (dataset / f"file{n}.txt").write_bytes(b"x" * n)
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, workers=1)
+        expected = (dataset / main.out_file).read_bytes()
+        (dataset / main.out_file).unlink()
+
+        real_md5_file = main.md5_file
+        hashed = []
+
+        def interrupted_md5_file(filename, algorithms=("md5",)):
+            if len(hashed) == 5:
+                raise KeyboardInterrupt
+            hashed.append(filename)
+            return real_md5_file(filename, algorithms)
+
+        monkeypatch.setattr(main, "md5_file", interrupted_md5_file)
+        with pytest.raises(KeyboardInterrupt):
+            main.checksum_folder(str(dataset), [".zip"], sink, sink, workers=1)
+        assert (dataset / (main.out_file + ".journal")).exists()
+
+        def counting_md5_file(filename, algorithms=("md5",)):
+            hashed.append(filename)
+            return real_md5_file(filename, algorithms)
+
+        monkeypatch.setattr(main, "md5_file", counting_md5_file)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, workers=1, resume=True)
+        assert (dataset / main.out_file).read_bytes() == expected
+        # 12 loose files: 5 before the interruption, the other 7 after it
+        assert len(hashed) == 12
+        assert len(set(hashed)) == 12
+
+
+class TestSortedManifest:
+
+    LINES = [
+        b"%s .\\%s\n" % (md5(name).encode(), name)
+        for name in (b"b\\z.txt", b"a.txt", b"b\\a.txt", b"c.txt", b"B.txt")
+    ]
+
+    def write_all(self, path, run_lines):
+        manifest = main.SortedManifest(str(path), run_lines)
+        for line in self.LINES:
+            manifest.write(line)
+        manifest.close()
+        manifest.close()
+        return path.read_bytes()
+
+    def test_sorted_by_path(self, tmp_path):
+        content = self.write_all(tmp_path / "out.md5", 100)
+        paths = [line[33:] for line in content.splitlines()]
+        assert paths == sorted(paths)
+        assert len(paths) == len(self.LINES)
+
+    def test_spilled_runs_give_same_manifest(self, tmp_path):
+        in_memory = self.write_all(tmp_path / "memory.md5", 100)
+        assert self.write_all(tmp_path / "spilled.md5", 2) == in_memory
+
+    def test_interrupted_run_keeps_previous_manifest(self, dataset, monkeypatch):
+        for n in range(10):
+            (dataset / f"file{n}.txt").write_bytes(b"x" * n)
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        previous = (dataset / main.out_file).read_bytes()
+        (dataset / "new.txt").write_bytes(b"new")
+        real_md5_file = main.md5_file
+        hashed = []
+
+        def interrupted_md5_file(filename, algorithms=("md5",)):
+            if len(hashed) == 5:
+                raise KeyboardInterrupt
+            hashed.append(filename)
+            return real_md5_file(filename, algorithms)
+
+        monkeypatch.setattr(main, "md5_file", interrupted_md5_file)
+        monkeypatch.setattr(main, "manifest_run_lines", 2)
+        with pytest.raises(KeyboardInterrupt):
+            main.checksum_folder(str(dataset), [".zip"], sink, sink, workers=1)
+        assert (dataset / main.out_file).read_bytes() == previous
+        assert not (dataset / (main.out_file + ".tmp")).exists()
+
+    def test_checksum_folder_output_is_sorted(self, dataset, monkeypatch):
+        for n in (3, 1, 2):
+            (dataset / "sub" / f"f{n}.txt").write_bytes(b"x" * n)
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        first = (dataset / main.out_file).read_bytes()
+        monkeypatch.setattr(main, "manifest_run_lines", 2)
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, workers=1)
+        assert (dataset / main.out_file).read_bytes() == first
+        paths = [line[33:] for line in first.splitlines()]
+        assert paths == sorted(paths)
+
+
+class TestToolFileNames:
+
+    def test_outputs_inside_the_folder(self, tmp_path):
+        choosedir = str(tmp_path / "data")
+        names = main.tool_file_names(
+            choosedir,
+            os.path.join(choosedir, "out", "x.md5"),
+            os.path.join(choosedir, "status.json"),
+            None,
+        )
+        assert os.path.join("out", "x.md5") in names
+        assert os.path.join("out", "x.sha256") in names
+        assert "status.json" in names
+
+    def test_outputs_elsewhere_are_left_out(self, monkeypatch):
+        monkeypatch.setattr(main.os, "path", ntpath)
+        names = main.tool_file_names(
+            "C:\\data", "D:\\manifests\\x.md5", "C:\\status.json"
+        )
+        assert names == [
+            main.out_file,
+            main.error_file,
+            main.metrics_file,
+            main.cache_file,
+        ] + [f"ACOUA_md5.{a}" for a in main.sidecar_algorithms]
+
+
+class TestVerifyFolder:
+
+    def make_manifest(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink)
+        return dataset / main.out_file
+
+    def test_unchanged_folder_verifies(self, dataset):
+        manifest = self.make_manifest(dataset)
+        sink = main.ConsoleProgress(io.StringIO())
+        verifier = main.verify_folder(str(dataset), str(manifest), [".zip"], sink, sink)
+        assert verifier.ok()
+        assert not (dataset / main.error_file).exists()
+
+    def test_tool_files_are_not_extra(self, dataset):
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(
+            str(dataset),
+            [".zip"],
+            sink,
+            sink,
+            cache_path=str(dataset / main.cache_file),
+            extra_algorithms=["sha256"],
+        )
+        manifest = dataset / main.out_file
+        verifier = main.verify_folder(str(dataset), str(manifest), [".zip"], sink, sink)
+        assert verifier.extra == []
+        assert verifier.ok()
+
+    def test_reports_mismatched_missing_and_extra(self, dataset):
+        manifest = self.make_manifest(dataset)
+        (dataset / "metadata.xml").write_bytes(b"<xml>changed</xml>")
+        (dataset / "sub" / "data.bin").unlink()
+        (dataset / "new.txt").write_bytes(b"new")
+        sink = main.ConsoleProgress(io.StringIO())
+        verifier = main.verify_folder(str(dataset), str(manifest), [".zip"], sink, sink)
+        assert verifier.mismatched == [".\\metadata.xml"]
+        assert verifier.missing == [".\\sub\\data.bin"]
+        assert verifier.extra == [".\\new.txt"]
+        assert "Checksum mismatch" in (dataset / main.error_file).read_text()
+
+    def test_archive_member_mismatch(self, dataset):
+        manifest = self.make_manifest(dataset)
+        make_zip({"inner/a.txt": b"changed"}, dataset / "sub" / "pack.zip")
+        sink = main.ConsoleProgress(io.StringIO())
+        verifier = main.verify_folder(str(dataset), str(manifest), [".zip"], sink, sink)
+        assert verifier.mismatched == [".\\sub\\inner\\a.txt"]
+
+    def test_duplicate_paths(self, dataset):
+        make_zip({"f.txt": b"from x"}, dataset / "sub" / "x.zip")
+        make_zip({"f.txt": b"from y"}, dataset / "sub" / "y.zip")
+        manifest = self.make_manifest(dataset)
+        sink = main.ConsoleProgress(io.StringIO())
+        verifier = main.verify_folder(str(dataset), str(manifest), [".zip"], sink, sink)
+        assert verifier.ok()
+        make_zip({"f.txt": b"changed"}, dataset / "sub" / "y.zip")
+        verifier = main.verify_folder(str(dataset), str(manifest), [".zip"], sink, sink)
+        assert verifier.mismatched == [".\\sub\\f.txt"]
+        assert verifier.missing == verifier.extra == []
+
+    def test_fail_fast_stops_at_first_failure(self, dataset):
+        manifest = self.make_manifest(dataset)
+        (dataset / "metadata.xml").write_bytes(b"changed")
+        (dataset / "sub" / "data.bin").write_bytes(b"changed")
+        sink = main.ConsoleProgress(io.StringIO())
+        verifier = main.verify_folder(
+            str(dataset), str(manifest), [".zip"], sink, sink, workers=1, fail_fast=True
+        )
+        assert len(verifier.mismatched) == 1
+        assert not verifier.ok()
+
+    def test_cli_exit_status(self, dataset, capsys):
+        self.make_manifest(dataset)
+        assert main.main_cli(["--dir", str(dataset), "--verify"]) == 0
+        (dataset / "metadata.xml").write_bytes(b"changed")
+        assert main.main_cli(["--dir", str(dataset), "--verify"]) == 1
+        assert "MISMATCH .\\metadata.xml" in capsys.readouterr().out
+
+    def test_parse_manifest_line_normalizes_to_nfc(self):
+        decomposed = "e\u0301"
+        line = f"{md5(b'x').upper()} .\\caf{decomposed}.txt\r\n".encode("utf-8")
+        assert main.parse_manifest_line(line) == (md5(b"x"), ".\\caf\u00e9.txt")
+
+
+class TestArchiveTasks:
+
+    def test_big_zips_are_split_in_ranges(self):
+        session = types.SimpleNamespace(
+            archivename="a.zip", members=["m1", "m2", "m3", "m4", "m5"]
+        )
+        content = {".zip": [session]}
+        tasks = list(main.archive_tasks(content, [".zip"], 2))
+        assert tasks == [
+            ("a.zip", ".zip", ["m1", "m2"]),
+            ("a.zip", ".zip", ["m3", "m4"]),
+            ("a.zip", ".zip", ["m5"]),
+        ]
+
+    def test_other_formats_are_not_split(self):
+        session = types.SimpleNamespace(archivename="a.tar", members=["m1", "m2", "m3"])
+        content = {".tar": [session]}
+        tasks = list(main.archive_tasks(content, [".tar"], 2))
+        assert tasks == [("a.tar", ".tar", ["m1", "m2", "m3"])]
+
+    def test_hash_archive_task(self, zip_archive, error_log):
+        path, content = zip_archive
+        md5list = main.hash_archive_task((str(path), ".zip", ["b.txt"]))
+        assert md5list == [("b.txt", {"md5": md5(content["b.txt"])})]
+
+    def test_hash_archive_task_corrupt_archive(self, tmp_path, error_log):
+        path = tmp_path / "bad.zip"
+        path.write_bytes(b"not a zip")
+        assert main.hash_archive_task((str(path), ".zip", [])) == []
+
+
+class TestNameIndex:
+
+    def test_caseless_and_normalized(self, error_log):
+        names = main.NameIndex()
+        assert names.add("sub/Stra\u00dfe/caf\u00e9.txt")
+        assert not names.add("SUB/STRASSE/cafe\u0301.TXT")
+        assert names.add("sub/strasse/cafe.txt")
+        assert names.conflicts == 1
+        assert "Name conflict: ./SUB/STRASSE" in error_log.read_text()
+
+    def test_member_conflicts_with_loose_file(self, dataset):
+        # pack.zip's inner/a.txt is extracted as sub/inner/a.txt
+        (dataset / "sub" / "Inner").mkdir()
+        (dataset / "sub" / "Inner" / "A.txt").write_bytes(b"loose a")
+        make_zip({"other/b.txt": b"b"}, dataset / "b.zip")
+        sink = main.ConsoleProgress(io.StringIO())
+        assert main.checksum_folder(str(dataset), [".zip"], sink, sink) is True
+        log = (dataset / main.error_file).read_text()
+        assert "Name conflict: ./sub/inner/a.txt" in log
+        assert log.count("Name conflict") == 1
+
+
+class TestScanFolder:
+
+    @pytest.fixture()
+    def root(self, tmp_path):
+        root = tmp_path / "data"
+        root.mkdir()
+        return root
+
+    def test_classifies_entries(self, root, error_log):
+        (root / "sub").mkdir()
+        (root / "a.txt").write_bytes(b"a")
+        (root / "sub" / "b.zip").write_bytes(b"b")
+        (root / "sub" / "c.tar.gz").write_bytes(b"c")
+        (root / "d.z01").write_bytes(b"d")
+        loose, archives, multipart = main.scan_folder(str(root), [".zip", ".tar.gz"])
+        assert sorted(e.name for e in loose) == ["a.txt", "d.z01"]
+        assert [e.name for e in archives[".zip"]] == ["b.zip"]
+        assert [e.name for e in archives[".tar.gz"]] == ["c.tar.gz"]
+        assert multipart == ["d.z01"]
+
+    def test_no_archiver_list_lists_archives_as_files(self, root, error_log):
+        (root / "b.zip").write_bytes(b"b")
+        loose, archives, _ = main.scan_folder(str(root), [])
+        assert [e.name for e in loose] == ["b.zip"]
+        assert archives == {}
+
+    def test_files_listed_before_subfolders(self, root, error_log):
+        (root / "sub" / "deeper").mkdir(parents=True)
+        (root / "sub" / "deeper" / "3.txt").write_bytes(b"3")
+        (root / "sub" / "2.txt").write_bytes(b"2")
+        (root / "1.txt").write_bytes(b"1")
+        loose, _, _ = main.scan_folder(str(root), [])
+        assert [e.name for e in loose] == ["1.txt", "2.txt", "3.txt"]
+
+    def test_folders_and_folder_links_are_not_listed(self, root, error_log):
+        (root / "real").mkdir()
+        (root / "real" / "x.txt").write_bytes(b"x")
+        (root / "link").symlink_to(root / "real", target_is_directory=True)
+        loose, _, _ = main.scan_folder(str(root), [])
+        assert [e.path for e in loose] == [str(root / "real" / "x.txt")]
+
+    def test_excluded_folders_are_not_listed(self, root, error_log, monkeypatch):
+        (root / "@eaDir" / "deep").mkdir(parents=True)
+        (root / "@eaDir" / "thumb.jpg").write_bytes(b"t")
+        (root / "keep").mkdir()
+        (root / "keep" / "x.txt").write_bytes(b"x")
+        (root / "keep" / "x.tmp").write_bytes(b"x")
+        (root / "keep" / "Thumbs.db").write_bytes(b"x")
+        listed = []
+        scandir = os.scandir
+
+        def spy(path):
+            listed.append(os.path.relpath(path, root))
+            return scandir(path)
+
+        monkeypatch.setattr(main.os, "scandir", spy)
+        exclusions = main.ExclusionFilter(patterns=["@eaDir", "*.tmp"])
+        loose, _, _ = main.scan_folder(str(root), [], exclusions)
+        assert [e.name for e in loose] == ["x.txt"]
+        assert listed == [".", "keep"]
+
+    def test_name_pattern_does_not_match_folders_on_the_way(self, root, error_log):
+        (root / "raw_data").mkdir()
+        (root / "raw_data" / "x.log").write_bytes(b"x")
+        (root / "raw1.log").write_bytes(b"x")
+        exclusions = main.ExclusionFilter(patterns=["raw*.log"])
+        loose, _, _ = main.scan_folder(str(root), [], exclusions)
+        assert [e.name for e in loose] == ["x.log"]
+
+
+class TestExclusionFilter:
+
+    def test_default_names_anywhere(self):
+        exclusions = main.ExclusionFilter()
+        assert exclusions.excludes(".DS_Store")
+        assert exclusions.excludes("a/b/Thumbs.db")
+        assert not exclusions.excludes("a/not.DS_Store")
+        assert not exclusions.excludes("a/Thumbs.db.txt")
+
+    def test_excluded_names_are_prefixes(self):
+        exclusions = main.ExclusionFilter([main.out_file, "out/manifest.md5"])
+        assert exclusions.excludes(main.out_file)
+        assert exclusions.excludes(main.out_file + ".journal")
+        assert exclusions.excludes("out/manifest.md5")
+        assert not exclusions.excludes("sub/" + main.out_file)
+
+    def test_patterns(self):
+        exclusions = main.ExclusionFilter(
+            patterns=["*.tmp", "desktop.ini", "raw/*.log"]
+        )
+        assert exclusions.excludes("a/b/c.tmp")
+        assert exclusions.excludes("desktop.ini")
+        assert exclusions.excludes("raw/run.log")
+        assert not exclusions.excludes("other/run.log")
+        assert not exclusions.excludes("a/c.tmp.txt")
+
+    def test_name_patterns_match_the_last_component(self):
+        exclusions = main.ExclusionFilter(patterns=["raw*.log", "a*b"])
+        assert exclusions.excludes("raw_data/raw1.log")
+        assert not exclusions.excludes("raw_data/x.log")
+        assert not exclusions.excludes("a/xb")
+
+
+class TestCompletionMap:
+
+    def test_yields_every_item_as_completed(self):
+        import concurrent.futures
+        import time
+
+        def slow_for_small(n):
+            time.sleep(0.001 * (10 - n))
+            return n * n
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as pool:
+            jobs = [
+                (pool, slow_for_small, range(10), 3, None),
+                (pool, str, "ab", 1, {"b": "cached"}.get),
+            ]
+            results = {
+                (job, item): future.result()
+                for job, item, future in main.completion_map(jobs)
+            }
+        assert results == {
+            **{(0, n): n * n for n in range(10)},
+            (1, "a"): "a",
+            (1, "b"): "cached",
+        }
+
+    def test_window_bounds_tasks_in_flight(self):
+        import concurrent.futures
+
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def task(n):
+            with lock:
+                running.append(n)
+                peak.append(len(running))
+            with lock:
+                running.remove(n)
+            return n
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+            jobs = [(pool, task, range(50), 2, None)]
+            items = [item for _, item, _ in main.completion_map(jobs)]
+        assert sorted(items) == list(range(50))
+        assert max(peak) <= 2
+
+    def test_lpt_order(self):
+        sizes = {"a": 1, "b": 500, "c": 20, "d": 20}
+        assert main.lpt_order(sizes, sizes.get) == ["b", "c", "d", "a"]
+
+    def test_largest_files_hashed_first(self, dataset, monkeypatch):
+        for n in (1, 300, 20):
+            (dataset / f"f{n}.bin").write_bytes(b"x" * n)
+        hashed = []
+        md5_file = main.md5_file
+
+        def spy(filename, algorithms=("md5",)):
+            hashed.append(filename)
+            return md5_file(filename, algorithms)
+
+        monkeypatch.setattr(main, "md5_file", spy)
+        sink = main.ConsoleProgress(io.StringIO())
+        main.checksum_folder(str(dataset), [".zip"], sink, sink, workers=1)
+        assert hashed[:2] == ["./f300.bin", "./f20.bin"]
+
+
+class TestMainCli:
+
+    def test_writes_manifest(self, dataset, capsys):
+        assert main.main_cli(["--dir", str(dataset), "--archives", ".zip"]) == 0
+        assert len(read_manifest(dataset / main.out_file)) == 3
+        assert "Done" in capsys.readouterr().err
+
+    def test_exclude_patterns(self, dataset):
+        (dataset / "scratch").mkdir()
+        (dataset / "scratch" / "a.txt").write_bytes(b"a")
+        (dataset / "sub" / "data.tmp").write_bytes(b"tmp")
+        argv = ["--dir", str(dataset), "--exclude", "*.tmp", "--exclude", "scratch"]
+        assert main.main_cli(argv) == 0
+        manifest = read_manifest(dataset / main.out_file)
+        assert sorted(manifest) == [
+            ".\\metadata.xml",
+            ".\\sub\\data.bin",
+            ".\\sub\\inner\\a.txt",
+        ]
+        assert main.main_cli(argv + ["--verify"]) == 0
+
+    def test_metrics_default_path(self, dataset):
+        assert main.main_cli(["--dir", str(dataset), "--metrics"]) == 0
+        report = json.loads((dataset / main.metrics_file).read_text())
+        assert report["version"] == main.version
+        assert len(read_manifest(dataset / main.out_file)) == 3
+
+    def test_rejects_unknown_extension(self, dataset):
+        with pytest.raises(SystemExit):
+            main.main_cli(["--dir", str(dataset), "--archives", ".exe"])
+
+    def test_rejects_unknown_algorithm(self, dataset):
+        with pytest.raises(SystemExit):
+            main.main_cli(["--dir", str(dataset), "--algorithms", "crc32"])
+
+    def test_rejects_missing_folder(self, tmp_path):
+        with pytest.raises(SystemExit):
+            main.main_cli(["--dir", str(tmp_path / "missing")])